@@ -0,0 +1,18 @@
+// Runs Seven headless on the VM emulator, with the OS functions native.
+// The program prints 7 at the top-left of the screen: the nine
+// non-blank rows of the font's '7' in the low byte of the first
+// word of each screen row.
+
+load,  // loads all the VM files from the current folder
+output-file Seven.out,
+compare-to Seven.cmp,
+
+output-list RAM[16384]%D2.6.2 RAM[16416]%D2.6.2 RAM[16448]%D2.6.2
+            RAM[16480]%D2.6.2 RAM[16512]%D2.6.2 RAM[16544]%D2.6.2
+            RAM[16576]%D2.6.2 RAM[16608]%D2.6.2 RAM[16640]%D2.6.2;
+
+repeat 100 {
+	vmstep;
+}
+
+output;
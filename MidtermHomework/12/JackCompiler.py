@@ -1,7 +1,29 @@
+import io
 import sys
 import re
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, Optional, Tuple
+
+COMPILER_VERSION = "3"  # bump when the generated code changes: it invalidates BuildManifest entries
+TOOLS = Path(__file__).resolve().parent.parent  # MidtermHomework: 6/6.py, 8/8.py
+
+def _load_tool(name: str, path: Path):
+    """Imports a sibling course tool by path (8.py, 6.py: not valid module names)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# The VM translator: the constant folder wraps words as its generated code does.
+translator = _load_tool('vm_translator', TOOLS / '8' / '8.py')
+_word = translator._word
 
 # -------------------------
 # Tokenizer
@@ -15,6 +37,7 @@ TOKEN_SPEC = [
     ('WS',      r'[ \t\r\n]+'),
 ]
 TOK_REGEX = '|'.join(f'(?P<{n}>{p})' for n, p in TOKEN_SPEC)
+TOK_PATTERN = re.compile(TOK_REGEX)
 KEYWORDS = {
     'class','constructor', 'function', 'method', 'field', 'static', 'var',
     'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this',
@@ -22,31 +45,39 @@ KEYWORDS = {
 }
 
 class Token:
+    __slots__ = ('kind', 'value', 'line')
+
     def __init__(self, kind: str, value: str, line: int):
         self.kind = kind
         self.value = value
         self.line = line
 
 class Tokenizer:
+    """Tokens are scanned as the parser asks for them; only the one being peeked at is held."""
     def __init__(self, text: str):
-        self.tokens: List[Token] = []
-        self.pos = 0
-        line_num = 1
-        for m in re.finditer(TOK_REGEX, text):
+        self._scanner = self._scan(text)
+        self._next: Optional[Token] = next(self._scanner, None)
+
+    @staticmethod
+    def _scan(text: str) -> Iterator[Token]:
+        line_num, counted = 1, 0
+        for m in TOK_PATTERN.finditer(text):
             kind = m.lastgroup
-            val = m.group(0)
             if kind == 'WS' or kind == 'COMMENT':
-                line_num += val.count('\n')
                 continue
+            start = m.start()
+            line_num += text.count('\n', counted, start)
+            counted = start
+            val = sys.intern(m.group())
             if kind == 'ID' and val in KEYWORDS:
                 kind = 'KEYWORD'
-            self.tokens.append(Token(kind, val, line_num))
+            yield Token(kind, val, line_num)
 
-    def has_more(self) -> bool: return self.pos < len(self.tokens)
-    def peek(self) -> Optional[Token]: return self.tokens[self.pos] if self.has_more() else None
+    def has_more(self) -> bool: return self._next is not None
+    def peek(self) -> Optional[Token]: return self._next
     def advance(self) -> Optional[Token]:
-        t = self.peek()
-        if t: self.pos += 1
+        t = self._next
+        if t: self._next = next(self._scanner, None)
         return t
     def expect(self, value: str = None, kind: str = None) -> Token:
         t = self.advance()
@@ -109,13 +140,17 @@ class CompilationEngine:
               '*':'call Math.multiply 2', '/':'call Math.divide 2'}
     UNARY_MAP = {'-':'neg', '~':'not'}
     SEG_MAP = {'static':'static', 'field':'this', 'arg':'argument', 'var':'local'}
+    MAX_CHAIN = 6  # longest add chain that replaces a Math.multiply call, in doublings + additions
 
-    def __init__(self, tokenizer: Tokenizer, writer: VMWriter):
+    def __init__(self, tokenizer: Tokenizer, writer: VMWriter, fold: bool = True):
         self.t = tokenizer
         self.w = writer
         self.sym = SymbolTable()
         self.class_name = ""
         self.label_id = 0
+        # Fold constant subexpressions and reduce * and / by constants.
+        self.fold = fold
+        self.calls_removed = 0  # Math.multiply / Math.divide calls that fold or reduce saved
 
     def new_label(self, prefix: str) -> str:
         self.label_id += 1
@@ -224,7 +259,7 @@ class CompilationEngine:
 
     def compile_do(self):
         self.t.expect('do')
-        self.compile_term() # Term handles calls
+        self.write_tree(self.term_tree()) # Term handles calls
         self.w.write_pop('temp', 0)
         self.t.expect(';')
 
@@ -266,96 +301,435 @@ class CompilationEngine:
         self.w.write_label(l_end)
 
     def compile_expression(self):
-        self.compile_term()
+        self.write_tree(self.expression_tree())
+
+    # An expression is parsed into a tree first, so constant subexpressions
+    # can be folded and * or / by a constant reduced before any code exists:
+    #   ('const', v) ('push', seg, idx) ('index', seg, idx, e) ('string', s)
+    #   ('call', name, [args]) ('unary', op, e) ('binary', op, l, r) ('mul', e, c)
+    def expression_tree(self) -> tuple:
+        tree = self.term_tree()
         while self.t.peek() and self.t.peek().value in self.OP_MAP:
             op = self.t.advance().value
-            self.compile_term()
-            self.w.write_arithmetic(self.OP_MAP[op])
+            tree = self.binary(op, tree, self.term_tree())
+        return tree
 
-    def compile_term(self):
+    def term_tree(self) -> tuple:
         t = self.t.advance()
         if t.kind == 'INT':
-            self.w.write_push('constant', int(t.value))
+            return ('const', int(t.value))
         elif t.kind == 'STRING':
-            s = t.value[1:-1]
-            self.w.write_push('constant', len(s))
-            self.w.write_call('String.new', 1)
-            for char in s:
-                self.w.write_push('constant', ord(char))
-                self.w.write_call('String.appendChar', 2)
+            return ('string', t.value[1:-1])
         elif t.kind == 'KEYWORD':
-            if t.value == 'this': self.w.write_push('pointer', 0)
-            elif t.value in ('null', 'false'): self.w.write_push('constant', 0)
-            elif t.value == 'true': 
-                self.w.write_push('constant', 0)
-                self.w.write_arithmetic('not')
+            if t.value == 'this': return ('push', 'pointer', 0)
+            elif t.value in ('null', 'false'): return ('const', 0)
+            elif t.value == 'true': return ('const', -1)
         elif t.value == '(':
-            self.compile_expression()
+            tree = self.expression_tree()
             self.t.expect(')')
+            return tree
         elif t.value in self.UNARY_MAP:
-            op = t.value
-            self.compile_term()
-            self.w.write_arithmetic(self.UNARY_MAP[op])
+            return self.unary(t.value, self.term_tree())
         elif t.kind == 'ID':
             name = t.value
             nxt = self.t.peek().value
             if nxt == '[':
                 self.t.advance()
-                self.compile_expression()
+                index = self.expression_tree()
                 self.t.expect(']')
-                self.w.write_push(self.SEG_MAP[self.sym.kind_of(name)], self.sym.index_of(name))
-                self.w.write_arithmetic('add')
-                self.w.write_pop('pointer', 1)
-                self.w.write_push('that', 0)
+                return ('index', self.SEG_MAP[self.sym.kind_of(name)], self.sym.index_of(name), index)
             elif nxt in ('(', '.'):
-                self.compile_call(name)
+                return self.call_tree(name)
             else:
-                self.w.write_push(self.SEG_MAP[self.sym.kind_of(name)], self.sym.index_of(name))
+                return ('push', self.SEG_MAP[self.sym.kind_of(name)], self.sym.index_of(name))
+        raise SyntaxError(f"Line {t.line}: Unexpected '{t.value}' in expression")
 
-    def compile_call(self, name: str):
-        n_args = 0
+    def call_tree(self, name: str) -> tuple:
         if self.t.peek().value == '.':
             self.t.advance()
             sub_name = self.t.expect(kind='ID').value
             typ = self.sym.type_of(name)
             if typ: # Method call on instance
-                self.w.write_push(self.SEG_MAP[self.sym.kind_of(name)], self.sym.index_of(name))
-                full_name, n_args = f"{typ}.{sub_name}", 1
+                args = [('push', self.SEG_MAP[self.sym.kind_of(name)], self.sym.index_of(name))]
+                full_name = f"{typ}.{sub_name}"
             else: # Static call
-                full_name, n_args = f"{name}.{sub_name}", 0
+                args, full_name = [], f"{name}.{sub_name}"
         else: # Internal method call
-            self.w.write_push('pointer', 0)
-            full_name, n_args = f"{self.class_name}.{name}", 1
-        
+            args, full_name = [('push', 'pointer', 0)], f"{self.class_name}.{name}"
+
         self.t.expect('(')
-        n_args += self.compile_expression_list()
+        args += self.expression_list()
         self.t.expect(')')
-        self.w.write_call(full_name, n_args)
+        return ('call', full_name, args)
 
-    def compile_expression_list(self) -> int:
-        n = 0
+    def expression_list(self) -> list:
+        trees = []
         if self.t.peek().value != ')':
-            self.compile_expression(); n = 1
+            trees.append(self.expression_tree())
             while self.t.peek().value == ',':
-                self.t.advance(); self.compile_expression(); n += 1
-        return n
+                self.t.advance(); trees.append(self.expression_tree())
+        return trees
+
+    def unary(self, op: str, e: tuple) -> tuple:
+        if self.fold and e[0] == 'const':
+            return ('const', _word(-e[1] if op == '-' else ~e[1]))
+        return ('unary', op, e)
+
+    def binary(self, op: str, l: tuple, r: tuple) -> tuple:
+        if not self.fold:
+            return ('binary', op, l, r)
+        if l[0] == 'const' and r[0] == 'const':
+            value = _fold(op, l[1], r[1])
+            if value is not None:
+                self.calls_removed += op in '*/'
+                return ('const', value)
+        if op == '*':
+            x, c = (r, l[1]) if l[0] == 'const' else (l, r[1]) if r[0] == 'const' else (None, None)
+            if c == 0 and _is_pure(x):
+                self.calls_removed += 1
+                return ('const', 0)
+            if c is not None and c != -32768 and _chain_steps(abs(c)) <= self.MAX_CHAIN:
+                self.calls_removed += 1
+                return ('mul', x, c)
+        elif op == '/' and r[0] == 'const' and r[1] in (1, -1):
+            self.calls_removed += 1
+            return l if r[1] == 1 else self.unary('-', l)
+        return ('binary', op, l, r)
+
+    def write_tree(self, e: tuple):
+        kind = e[0]
+        if kind == 'const':
+            v = e[1]
+            if v >= 0:
+                self.w.write_push('constant', v)
+            elif v in (-1, -32768): # ~0, ~32767
+                self.w.write_push('constant', ~v)
+                self.w.write_arithmetic('not')
+            else:
+                self.w.write_push('constant', -v)
+                self.w.write_arithmetic('neg')
+        elif kind == 'push':
+            self.w.write_push(e[1], e[2])
+        elif kind == 'index':
+            self.write_tree(e[3])
+            self.w.write_push(e[1], e[2])
+            self.w.write_arithmetic('add')
+            self.w.write_pop('pointer', 1)
+            self.w.write_push('that', 0)
+        elif kind == 'string':
+            self.w.write_push('constant', len(e[1]))
+            self.w.write_call('String.new', 1)
+            for char in e[1]:
+                self.w.write_push('constant', ord(char))
+                self.w.write_call('String.appendChar', 2)
+        elif kind == 'call':
+            for arg in e[2]:
+                self.write_tree(arg)
+            self.w.write_call(e[1], len(e[2]))
+        elif kind == 'unary':
+            self.write_tree(e[2])
+            self.w.write_arithmetic(self.UNARY_MAP[e[1]])
+        elif kind == 'binary':
+            self.write_tree(e[2])
+            self.write_tree(e[3])
+            self.w.write_arithmetic(self.OP_MAP[e[1]])
+        else:
+            self.write_multiply(e[1], e[2])
+
+    def write_multiply(self, x: tuple, c: int):
+        """x * c as a shift-and-add chain: temp 1 holds x unless it is a plain push, temp 0 doubles."""
+        if c == 0: # x has side effects: run it, then x & 0
+            self.write_tree(x)
+            self.w.write_push('constant', 0)
+            self.w.write_arithmetic('and')
+            return
+        if x[0] not in ('push', 'const') and abs(c) > 1:
+            self.write_tree(x)
+            self.w.write_pop('temp', 1)
+            x = ('push', 'temp', 1)
+        self.write_tree(x)
+        for i, bit in enumerate(bin(abs(c))[3:]):
+            if i > 0:
+                self.w.write_pop('temp', 0)
+                self.w.write_push('temp', 0)
+            self.write_tree(x if i == 0 else ('push', 'temp', 0))
+            self.w.write_arithmetic('add')
+            if bit == '1':
+                self.write_tree(x)
+                self.w.write_arithmetic('add')
+        if c < 0:
+            self.w.write_arithmetic('neg')
+
+def _fold(op: str, a: int, b: int) -> Optional[int]:
+    """a op b as the Hack computer would compute it; None for a division by zero."""
+    if op == '/':
+        if b == 0: return None # left to Math.divide, which reports it
+        q = abs(a) // abs(b)
+        return _word(q if (a < 0) == (b < 0) else -q)
+    if op in '<>=':
+        # The VM translator compares through a wrapped x - y, overflow included.
+        diff = _word(a - b)
+        return -{'<': diff < 0, '>': diff > 0, '=': diff == 0}[op]
+    return _word({'+': a + b, '-': a - b, '*': a * b, '&': a & b, '|': a | b}[op])
+
+def _chain_steps(c: int) -> int:
+    """Doublings plus additions write_multiply needs for x * c."""
+    return c.bit_length() - 1 + bin(c).count('1') - 1
+
+def _is_pure(e: tuple) -> bool:
+    """True when evaluating e has no effect besides its value."""
+    if e[0] in ('call', 'string'): return False
+    return all(_is_pure(sub) for sub in e[1:] if isinstance(sub, tuple))
 
 # -------------------------
-# Driver
+# Build Manifest
 # -------------------------
-def main():
-    path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path('.')
-    for f in (path.glob('*.jack') if path.is_dir() else [path]):
-        tokenizer = Tokenizer(f.read_text())
-        writer = VMWriter(f.with_suffix('.vm'))
-        engine = CompilationEngine(tokenizer, writer)
+class BuildManifest:
+    """Content hash of each .jack file whose .vm file is up to date.
+
+    A class compiles to the same VM code whatever the classes around it
+    contain (calls are resolved by name only), so a file whose hash is
+    unchanged is skipped without being tokenized. The whole manifest is
+    dropped when the compiler version or options differ from the last run.
+    """
+    FILENAME = '.jackbuild.json'
+
+    def __init__(self, directory: Path, options: dict):
+        self.path = directory / self.FILENAME
+        self.stamp = {'version': COMPILER_VERSION, 'options': options}
+        self.hashes = {}
         try:
-            engine.compile_class()
-            print(f"Done: {f.name}")
-        except Exception as e:
-            print(f"Error in {f.name}: {e}")
+            data = json.loads(self.path.read_text())
+            if data.get('stamp') == self.stamp:
+                self.hashes = data['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def digest(f: Path) -> str:
+        return hashlib.sha1(f.read_bytes()).hexdigest()
+
+    def is_fresh(self, f: Path, digest: str) -> bool:
+        return self.hashes.get(f.name) == digest and f.with_suffix('.vm').exists()
+
+    def record(self, f: Path, digest: Optional[str]):
+        if digest is None:
+            self.hashes.pop(f.name, None)
+        else:
+            self.hashes[f.name] = digest
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'stamp': self.stamp, 'files': self.hashes}, indent=1, sort_keys=True))
+        tmp.replace(self.path)
+
+# -------------------------
+# Watch Mode
+# -------------------------
+class Watcher:
+    """Keeps the jack -> vm -> asm -> hack chain of one project directory warm.
+
+    Every class keeps its translation and its relocatable object (6.py
+    assemble_object) in memory, so a change redoes the stages of the changed
+    sources only and then relinks Bootstrap + classes into <dir>.asm/.hack,
+    the image `8.py dir` and `6.py dir.asm` would build. .vm files without a
+    .jack beside them (usually the OS) are sources too.
+    """
+    STAGES = ('jack', 'vm', 'asm', 'link', 'write')
+
+    def __init__(self, directory: Path, options: dict):
+        self.translator = translator
+        self.assembler = _load_tool('hack_assembler', TOOLS / '6' / '6.py')
+        self.directory = directory
+        self.options = options
+        self.manifest = BuildManifest(directory, options)
+        self.seen = {}    # source -> (mtime_ns, size) at the last poll
+        self.units = {}   # .vm file name -> (asm text, object)
+        self.errors = {}  # .vm file name -> message of its last failed build
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+
+        boot = io.StringIO()
+        cw = self.translator.CodeWriter(boot)
+        cw.write_init()
+        cw.finish_file()
+        self.bootstrap = (boot.getvalue(), self._assemble(boot.getvalue(), 'Bootstrap'))
+
+    def _timed(self, stage: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
         finally:
-            writer.close()
+            self.timings[stage] += time.perf_counter() - start
+
+    def _assemble(self, text: str, module: str) -> dict:
+        return self.assembler.Assembler().assemble_object(text.splitlines(), module)
+
+    def sources(self) -> list:
+        jack = sorted(self.directory.glob('*.jack'))
+        names = {f.stem for f in jack}
+        return jack + sorted(f for f in self.directory.glob('*.vm') if f.stem not in names)
+
+    def poll(self):
+        """Returns the sources added or changed since the last poll, and those removed."""
+        current = {}
+        for f in self.sources():
+            try:
+                st = f.stat()
+            except OSError:  # deleted since the glob
+                continue
+            current[f] = (st.st_mtime_ns, st.st_size)
+        changed = [f for f, sig in current.items() if self.seen.get(f) != sig]
+        removed = [f for f in self.seen if f not in current]
+        self.seen = current
+        return changed, removed
+
+    def rebuild(self, changed: list, removed: list):
+        self.timings = dict.fromkeys(self.STAGES, 0.0)
+        for f in removed:
+            self.units.pop(f.with_suffix('.vm').name, None)
+            self.errors.pop(f.with_suffix('.vm').name, None)
+        for f in changed:
+            vm_file = f.with_suffix('.vm')
+            if f.suffix == '.jack':
+                digest = self.manifest.digest(f)
+                if not self.manifest.is_fresh(f, digest):  # e.g. only touched
+                    error, calls_removed = self._timed('jack', partial(compile_file, **self.options), f)
+                    self.manifest.record(f, None if error else digest)
+                    if error:
+                        print(f"Error in {f.name}: {error}")
+                        self.units.pop(vm_file.name, None)
+                        self.errors[vm_file.name] = error
+                        continue
+                    print(done_message(f, calls_removed))
+            try:
+                commands = self._timed('vm', lambda: self.translator.Parser(str(vm_file)).commands)
+                text = self._timed('vm', self.translator.translate_file, str(vm_file), commands, {})[0]
+                self.units[vm_file.name] = (text, self._timed('asm', self._assemble, text, vm_file.stem))
+            except Exception as e:  # e.g. a half-edited .vm file: keep watching
+                print(f"Error in {vm_file.name}: {e}")
+                self.units.pop(vm_file.name, None)
+                self.errors[vm_file.name] = str(e)
+                continue
+            self.errors.pop(vm_file.name, None)
+        self.manifest.save()
+
+        names = ", ".join(f.name for f in changed + removed)
+        if self.errors:
+            print(f"Not linked: {len(self.errors)} files failed ({names})")
+            return
+        units = [self.bootstrap] + [self.units[name] for name in sorted(self.units)]
+        missing = self._unresolved([obj for _, obj in units])
+        if missing:
+            # The linker would make them RAM variables: calls into a deleted class.
+            for module, functions in missing.items():
+                print(f"Unresolved in {module}: {', '.join(functions)}")
+            print(f"Not linked: calls to functions defined nowhere ({names})")
+            return
+        try:
+            rom = self._timed('link', self.assembler.link, [obj for _, obj in units])
+        except ValueError as e:
+            print(f"Link error: {e}")
+            return
+        self._timed('write', self._write, "".join(text for text, _ in units), rom)
+        stages = ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in self.timings.items())
+        print(f"Rebuilt {names}: {stages}; total {sum(self.timings.values()) * 1000:.1f} ms, {len(rom)} words")
+
+    @staticmethod
+    def _unresolved(objects: list) -> dict:
+        """Imports that no module exports, by module."""
+        exported = set().union(*(obj['exports'] for obj in objects))
+        missing = {}
+        for obj in objects:
+            names = [name for name, kind, _ in obj['externals'] if kind == 'import' and name not in exported]
+            if names:
+                missing[obj['module']] = names
+        return missing
+
+    def _write(self, asm_text: str, rom):
+        image = self.directory / self.directory.resolve().name
+        image.with_suffix('.asm').write_text(asm_text)
+        image.with_suffix('.hack').write_text(self.assembler.hack_text(rom))
+
+    def run(self, interval: float):
+        print(f"Watching {self.directory} every {interval} s, Ctrl-C to stop")
+        try:
+            while True:
+                changed, removed = self.poll()
+                if changed or removed:
+                    self.rebuild(changed, removed)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+# -------------------------
+# Driver
+# -------------------------
+def compile_file(f: Path, fold: bool = True) -> Tuple[Optional[str], int]:
+    """Compiles one class to its .vm file.
+
+    Returns the error message, or None, and the number of Math calls removed.
+    """
+    tokenizer = Tokenizer(f.read_text())
+    writer = VMWriter(f.with_suffix('.vm'))
+    engine = CompilationEngine(tokenizer, writer, fold)
+    try:
+        engine.compile_class()
+        return None, engine.calls_removed
+    except Exception as e:
+        return str(e), 0
+    finally:
+        writer.close()
+
+def done_message(f: Path, calls_removed: int) -> str:
+    return f"Done: {f.name}" + (f" ({calls_removed} Math calls removed)" if calls_removed else "")
+
+def main():
+    parser = argparse.ArgumentParser(description="Jack to VM compiler")
+    parser.add_argument('path', nargs='?', default='.', help="a .jack file or a directory of them")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="compile the classes in this many processes (0: one per CPU)")
+    parser.add_argument('--no-fold', dest='fold', action='store_false',
+                        help="compile * and / to Math calls as written, without folding constants")
+    parser.add_argument('--force', action='store_true', help="recompile classes whose source has not changed")
+    parser.add_argument('--watch', action='store_true',
+                        help="directory mode: keep rebuilding <dir>.hack through 8.py and 6.py as sources change")
+    parser.add_argument('--interval', type=float, default=0.1, help="--watch polling period in seconds")
+    args = parser.parse_args()
+    # Everything that can change the generated code goes into the manifest stamp.
+    options = {k: v for k, v in vars(args).items() if k not in ('path', 'jobs', 'force', 'watch', 'interval')}
+
+    path = Path(args.path)
+    if args.watch:
+        if not path.is_dir():
+            parser.error("--watch needs a directory")
+        Watcher(path, options).run(args.interval)
+        return
+    files = sorted(path.glob('*.jack')) if path.is_dir() else [path]
+    manifest = BuildManifest(path if path.is_dir() else path.parent, options)
+    digests = [manifest.digest(f) for f in files]
+    stale = [f for f, d in zip(files, digests) if args.force or not manifest.is_fresh(f, d)]
+    compile_one = partial(compile_file, **options)
+    if args.jobs != 1 and len(stale) > 1:
+        with ProcessPoolExecutor(args.jobs or None) as pool:
+            results = dict(zip(stale, pool.map(compile_one, stale)))
+    else:
+        results = {f: compile_one(f) for f in stale}
+
+    # Reported in file name order, however the work was scheduled.
+    errors = []
+    for f, digest in zip(files, digests):
+        if f not in results:
+            print(f"Up to date: {f.name}")
+            continue
+        error, calls_removed = results[f]
+        errors.append(error)
+        manifest.record(f, None if error else digest)
+        print(f"Error in {f.name}: {error}" if error else done_message(f, calls_removed))
+    manifest.save()
+    failed = sum(1 for error in errors if error)
+    if failed:
+        print(f"{failed} of {len(files)} classes failed")
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
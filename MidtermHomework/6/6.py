@@ -1,41 +1,374 @@
 import sys
 import os
+import argparse
+import hashlib
+import json
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+
+ASSEMBLER_VERSION = "1"
+C_PREFIX = 0b111 << 13
+HEADER_MAGIC = b"HACK"
+MAX_CONSTANT = 0x7FFF  # an A-Instruction holds 15 bits
+# 8-bit binary strings, so a word becomes text with two lookups.
+BYTE_BITS = [format(i, '08b') for i in range(256)]
+
+# Built once per process and shared read-only by every Assembler.
+PREDEFINED_SYMBOLS = MappingProxyType({
+    "SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+    "SCREEN": 16384, "KBD": 24576,
+    **{f"R{i}": i for i in range(16)}
+})
+
+# Mnemonics tables as bit fields, already shifted into place.
+DEST_TABLE = MappingProxyType({k: v << 3 for k, v in {
+    "null": 0b000, "M": 0b001, "D": 0b010, "MD": 0b011,
+    "A": 0b100, "AM": 0b101, "AD": 0b110, "AMD": 0b111
+}.items()})
+
+JUMP_TABLE = MappingProxyType({
+    "null": 0b000, "JGT": 0b001, "JEQ": 0b010, "JGE": 0b011,
+    "JLT": 0b100, "JNE": 0b101, "JLE": 0b110, "JMP": 0b111
+})
+
+COMP_TABLE = MappingProxyType({k: C_PREFIX | v << 6 for k, v in {
+    "0": 0b0101010, "1": 0b0111111, "-1": 0b0111010,
+    "D": 0b0001100, "A": 0b0110000, "!D": 0b0001101,
+    "!A": 0b0110001, "-D": 0b0001111, "-A": 0b0110011,
+    "D+1": 0b0011111, "A+1": 0b0110111, "D-1": 0b0001110,
+    "A-1": 0b0110010, "D+A": 0b0000010, "D-A": 0b0010011,
+    "A-D": 0b0000111, "D&A": 0b0000000, "D|A": 0b0010101,
+    "M": 0b1110000, "!M": 0b1110001, "-M": 0b1110011,
+    "M+1": 0b1110111, "M-1": 0b1110010, "D+M": 0b1000010,
+    "D-M": 0b1010011, "M-D": 0b1000111, "D&M": 0b1000000,
+    "D|M": 0b1010101
+}.items()})
+
+
+class AssemblyError(ValueError):
+    """An instruction that cannot be encoded; args are its cleaned text and the reason.
+
+    `where` is filled in by the caller that knows the file and line.
+    """
+    where = ""
+
+    def __str__(self):
+        instruction, reason = self.args
+        return f"{self.where}'{instruction}': {reason}"
+
+
+def _constant(line):
+    """The value of '@<digits>', checked against the A-Instruction range."""
+    value = int(line[1:])
+    if value > MAX_CONSTANT:
+        raise AssemblyError(line, f"constant out of range (0..{MAX_CONSTANT})")
+    return value
+
+
+def hack_text(rom):
+    """Renders a ROM buffer as .hack text, one 16-bit binary word per line."""
+    return "".join([BYTE_BITS[w >> 8] + BYTE_BITS[w & 0xFF] + "\n" for w in rom])
+
+
+def rom_bytes(rom, header=False):
+    """Renders a ROM buffer as raw little-endian 16-bit words.
+
+    With `header`, the words are preceded by HEADER_MAGIC and the word count
+    as a little-endian uint32.
+    """
+    if sys.byteorder != "little":
+        rom = array('H', rom)
+        rom.byteswap()
+    data = rom.tobytes()
+    if header:
+        data = HEADER_MAGIC + len(rom).to_bytes(4, "little") + data
+    return data
+
+
+class EncodingCache:
+    """Bounded LRU from C-Instruction text to its encoded word.
+
+    Keys are lines as produced by clean_line, so comments and surrounding
+    whitespace never split an entry. One cache can serve many Assemblers.
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.words = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, line, encode):
+        word = self.words.get(line)
+        if word is not None:
+            self.hits += 1
+            self.words.move_to_end(line)
+            return word
+        return self.miss(line, encode)
+
+    def miss(self, line, encode):
+        self.misses += 1
+        word = self.words[line] = encode(line)
+        if len(self.words) > self.max_size:
+            self.words.popitem(last=False)
+            self.evictions += 1
+        return word
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"C-Instruction cache: {self.hits} hits, {self.misses} misses "
+                f"({rate:.1f}% hit rate), {len(self.words)} entries, {self.evictions} evictions")
+
+class RomCache:
+    """Assembled ROMs keyed by a hash of the cleaned instruction stream.
+
+    Entries are kept in memory, least recently used dropped first once they
+    pass `max_bytes`. With a `directory` they are also stored as <key>.rom
+    files (raw little-endian words) so hits survive between runs; the
+    directory is trimmed to `max_bytes` by access time the same way.
+    """
+    def __init__(self, directory=None, max_bytes=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.roms = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(cleaned_lines, options=""):
+        h = hashlib.sha1(f"{ASSEMBLER_VERSION}\0{options}\0".encode())
+        h.update("\n".join(cleaned_lines).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        rom = self.roms.get(key)
+        if rom is not None:
+            self.roms.move_to_end(key)
+        elif self.directory:
+            path = os.path.join(self.directory, key + ".rom")
+            try:
+                with open(path, 'rb') as f:
+                    rom = array('H', f.read())
+                os.utime(path)
+            except OSError:
+                rom = None
+            else:
+                if sys.byteorder != "little":
+                    rom.byteswap()
+                self._remember(key, rom)
+        if rom is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return array('H', rom)
+
+    def put(self, key, rom):
+        self._remember(key, array('H', rom))
+        if self.directory:
+            path = os.path.join(self.directory, key + ".rom")
+            with open(path + ".tmp", 'wb') as f:
+                f.write(rom_bytes(rom))
+            os.replace(path + ".tmp", path)
+            self._trim_directory()
+
+    def _remember(self, key, rom):
+        if key in self.roms:
+            return
+        self.roms[key] = rom
+        self.size += len(rom) * 2
+        while self.size > self.max_bytes and len(self.roms) > 1:
+            self.size -= len(self.roms.popitem(last=False)[1]) * 2
+
+    def _trim_directory(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".rom"):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_atime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+class Peephole:
+    """Rewrites a cleaned instruction stream (labels included) into a shorter one.
+
+    Window patterns never span a label, so every jump target still sees the
+    code it saw before, and each replacement leaves D, A and every RAM write
+    as they were. Jumps that use A only as their target are threaded through
+    `@L 0;JMP` trampolines, jumps to the very next instruction are dropped,
+    and so are labels nothing refers to together with code that can no
+    longer be reached. Runs to a fixpoint.
+    """
+    PATTERNS = [
+        # _push_d_to_stack followed by _pop_stack_to_d: SP goes up and down again.
+        ("push-pop", ["@SP", "M=M+1", "@SP", "AM=M-1"], ["@SP", "A=M"]),
+        ("sp-reload", ["@SP", "A=M", "M=D", "@SP", "A=M"], ["@SP", "A=M", "M=D"]),
+        ("store-reload", ["M=D", "D=M"], ["M=D"]),
+    ]
 
-class Assembler:
     def __init__(self):
-        # 1. Predefined Symbols
-        self.symbol_table = {
-            "SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
-            "SCREEN": 16384, "KBD": 24576
-        }
-        for i in range(16):
-            self.symbol_table[f"R{i}"] = i
-        
-        self.variable_address = 16
+        self.counts = {}
+        self.before = self.after = 0
 
-        # 2. Mnemonics Tables
-        self.dest_table = {
-            "null": "000", "M": "001", "D": "010", "MD": "011",
-            "A": "100", "AM": "101", "AD": "110", "AMD": "111"
-        }
+    def _hit(self, rule):
+        self.counts[rule] = self.counts.get(rule, 0) + 1
 
-        self.jump_table = {
-            "null": "000", "JGT": "001", "JEQ": "010", "JGE": "011",
-            "JLT": "100", "JNE": "101", "JLE": "110", "JMP": "111"
-        }
+    @staticmethod
+    def _rom_size(lines):
+        return sum(1 for line in lines if not line.startswith("("))
 
-        self.comp_table = {
-            "0": "0101010", "1": "0111111", "-1": "0111010",
-            "D": "0001100", "A": "0110000", "!D": "0001101",
-            "!A": "0110001", "-D": "0001111", "-A": "0110011",
-            "D+1": "0011111", "A+1": "0110111", "D-1": "0001110",
-            "A-1": "0110010", "D+A": "0000010", "D-A": "0010011",
-            "A-D": "0000111", "D&A": "0000000", "D|A": "0010101",
-            "M": "1110000", "!M": "1110001", "-M": "1110011",
-            "M+1": "1110111", "M-1": "1110010", "D+M": "1000010",
-            "D-M": "1010011", "M-D": "1000111", "D&M": "1000000",
-            "D|M": "1010101"
-        }
+    def optimize(self, lines):
+        self.before = self.after = self._rom_size(lines)
+        if self._has_numeric_jumps(lines):
+            # Removing any word would move the targets under their feet.
+            self.counts = {"skipped: jumps to numeric addresses": 1}
+            return lines
+        while True:
+            new = self._patterns(lines)
+            new = self._redundant_loads(new)
+            new = self._thread_jumps(new)
+            new = self._dead_code(new)
+            if new == lines:
+                break
+            lines = new
+        self.after = self._rom_size(lines)
+        return lines
+
+    @staticmethod
+    def _has_numeric_jumps(lines):
+        return any(line[1:].isdigit() and ";" in nxt for line, nxt in zip(lines, lines[1:]))
+
+    def _patterns(self, lines):
+        out, i = [], 0
+        while i < len(lines):
+            for rule, pattern, replacement in self.PATTERNS:
+                if lines[i:i + len(pattern)] == pattern:
+                    out.extend(replacement)
+                    i += len(pattern)
+                    self._hit(rule)
+                    break
+            else:
+                out.append(lines[i])
+                i += 1
+        return out
+
+    def _redundant_loads(self, lines):
+        """Drops @X when A is already known to hold X."""
+        out, known = [], None
+        for line in lines:
+            if line.startswith("("):
+                known = None
+            elif line.startswith("@"):
+                if line == known:
+                    self._hit("redundant-load")
+                    continue
+                known = line
+            elif "A" in line.split("=")[0] and "=" in line:
+                known = None
+            out.append(line)
+        return out
+
+    @staticmethod
+    def _uses_a(instruction):
+        """True when dest=comp (the part before ';') reads or writes A or M."""
+        return "A" in instruction or "M" in instruction
+
+    def _thread_jumps(self, lines):
+        # label -> index of the first instruction at that address
+        targets, pending = {}, []
+        for i, line in enumerate(lines):
+            if line.startswith("("):
+                pending.append(line[1:-1])
+            else:
+                for label in pending:
+                    targets[label] = i
+                pending = []
+
+        out = []
+        for i, line in enumerate(lines):
+            # Only a jump that uses A as its target alone: a comp or dest that
+            # reads or writes A or M would see a different address.
+            is_jump_target = (line.startswith("@") and i + 1 < len(lines)
+                              and ";" in lines[i + 1]
+                              and not self._uses_a(lines[i + 1].split(";")[0]))
+            if is_jump_target:
+                label, seen = line[1:], set()
+                while label in targets and label not in seen:
+                    seen.add(label)
+                    t = targets[label]
+                    if (t + 1 < len(lines) and lines[t].startswith("@")
+                            and lines[t + 1] == "0;JMP"):
+                        label = lines[t][1:]
+                    else:
+                        break
+                if "@" + label != line:
+                    self._hit("jump-thread")
+                    line = "@" + label
+            out.append(line)
+
+        # @L / comp;jump where (L) is the next address
+        result, i = [], 0
+        while i < len(out):
+            line = out[i]
+            if (line.startswith("@") and i + 1 < len(out) and ";" in out[i + 1]
+                    and "=" not in out[i + 1]):
+                j = i + 2
+                while j < len(out) and out[j].startswith("("):
+                    if out[j] == "(" + line[1:] + ")":
+                        break
+                    j += 1
+                if j < len(out) and out[j] == "(" + line[1:] + ")":
+                    self._hit("jump-to-next")
+                    i += 2
+                    continue
+            result.append(line)
+            i += 1
+        return result
+
+    def _dead_code(self, lines):
+        live = {line[1:] for line in lines if line.startswith("@")}
+        out, reachable = [], True
+        for line in lines:
+            if line.startswith("("):
+                if line[1:-1] not in live:
+                    self._hit("dead-label")
+                    continue
+                reachable = True
+            elif not reachable:
+                self._hit("unreachable")
+                continue
+            elif line.endswith(";JMP"):
+                out.append(line)
+                reachable = False
+                continue
+            out.append(line)
+        return out
+
+    def report(self):
+        rules = ", ".join(f"{rule} {n}" for rule, n in sorted(self.counts.items()))
+        return (f"Peephole: saved {self.before - self.after} ROM words "
+                f"({self.before} -> {self.after}); {rules or 'nothing to do'}")
+
+class Assembler:
+    def __init__(self, cache=None):
+        # 1. Predefined Symbols (a plain copy per program, it grows with labels/variables)
+        self.symbol_table = dict(PREDEFINED_SYMBOLS)
+        self.variable_address = 16
+        self.cache = cache if cache is not None else _encoding_cache
+
+        # 2. Mnemonics Tables, shared by every Assembler in the process
+        self.dest_table = DEST_TABLE
+        self.jump_table = JUMP_TABLE
+        self.comp_table = COMP_TABLE
 
     def clean_line(self, line):
         """Removes whitespace and comments."""
@@ -59,56 +392,432 @@ class Assembler:
         return cleaned_lines
 
     def second_pass(self, lines):
-        """Translates instructions to binary."""
-        machine_code = []
+        """Translates instructions to a ROM buffer of 16-bit words."""
+        machine_code = array('H')
+        # The cache lookup is inlined here: this loop is the hot path.
+        cache = self.cache
+        cached = cache.words.get
+        touch = cache.words.move_to_end
+        hits = 0
         for line in lines:
             if line.startswith("@"):
                 # A-Instruction
                 val = line[1:]
                 if val.isdigit():
-                    address = int(val)
+                    address = _constant(line)
                 else:
                     if val not in self.symbol_table:
                         self.symbol_table[val] = self.variable_address
                         self.variable_address += 1
                     address = self.symbol_table[val]
-                machine_code.append(format(address, '016b'))
+                machine_code.append(address)
             else:
-                # C-Instruction: dest=comp;jump
-                dest, comp, jump = "null", "", "null"
-                
-                if "=" in line:
-                    dest, line = line.split("=")
-                if ";" in line:
-                    comp, jump = line.split(";")
+                word = cached(line)
+                if word is None:
+                    word = cache.miss(line, self._encode_c)
                 else:
-                    comp = line
-                
-                binary = "111" + self.comp_table[comp] + self.dest_table[dest] + self.jump_table[jump]
-                machine_code.append(binary)
+                    hits += 1
+                    touch(line)
+                machine_code.append(word)
+        cache.hits += hits
+        return machine_code
+
+    def assemble_cached(self, lines, rom_cache=None):
+        """Assembles `lines` to a ROM buffer, reusing earlier results.
+
+        Identical programs (after clean_line) are only encoded once per
+        `rom_cache`, which defaults to one shared by the whole process. A miss
+        is encoded on a fresh symbol table, so labels and variables of earlier
+        programs never reach the cache; this instance's table is not touched.
+        """
+        if rom_cache is None:
+            rom_cache = _rom_cache
+        cleaned = [c for c in map(self.clean_line, lines) if c]
+        key = rom_cache.key(cleaned)
+        rom = rom_cache.get(key)
+        if rom is None:
+            rom = assemble(cleaned, self.cache)
+            rom_cache.put(key, rom)
+        return rom
+
+    def allocate_variables(self, lines):
+        """Assigns RAM to every variable, in order of first appearance.
+
+        This is the only order-dependent part of second_pass; once it is done
+        the instructions can be encoded in any order.
+        """
+        for line in lines:
+            if line.startswith("@"):
+                val = line[1:]
+                if not val.isdigit() and val not in self.symbol_table:
+                    self.symbol_table[val] = self.variable_address
+                    self.variable_address += 1
+
+    def parallel_second_pass(self, lines, jobs=None, chunks_per_job=4):
+        """second_pass split into chunks over a process pool.
+
+        The output is identical to second_pass: variables are allocated here
+        first, and every worker gets the finished symbol table once. Each
+        worker keeps its own EncodingCache and reports its counters per
+        chunk; they are added to this Assembler's cache.
+        """
+        jobs = jobs or os.cpu_count() or 1
+        if jobs <= 1:  # a pool would only add start-up and pickling
+            return self.second_pass(lines)
+        self.allocate_variables(lines)
+        size = max(1, -(-len(lines) // (jobs * chunks_per_job)))
+        chunks = [lines[i:i + size] for i in range(0, len(lines), size)]
+        machine_code = array('H')
+        cache = self.cache
+        with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                 initargs=(self.symbol_table, cache.max_size)) as pool:
+            for packed, hits, misses, evictions in pool.map(_encode_chunk, chunks):
+                machine_code.frombytes(packed)
+                cache.hits += hits
+                cache.misses += misses
+                cache.evictions += evictions
         return machine_code
 
+    def c_instruction(self, line):
+        """Encodes a C-Instruction, through the cache."""
+        return self.cache.get(line, self._encode_c)
+
+    def _encode_c(self, line):
+        """Encodes a C-Instruction: dest=comp;jump"""
+        dest, comp, jump = "null", "", "null"
+
+        if "=" in line:
+            dest, line = line.split("=")
+        if ";" in line:
+            comp, jump = line.split(";")
+        else:
+            comp = line
+
+        return self.comp_table[comp] | self.dest_table[dest] | self.jump_table[jump]
+
+    def assemble_object(self, lines, module):
+        """Assembles one module into a relocatable object (a JSON-able dict).
+
+        Words referring to the module's own labels hold the label's offset and
+        are listed in `relocs`. Symbols the module does not define are left
+        as 0 and listed in `externals` in order of first appearance, tagged
+        "static" for the module's own `Module.n` slots and "import" otherwise;
+        the linker resolves them. All labels are exported.
+        """
+        predefined = PREDEFINED_SYMBOLS
+        cleaned = self.first_pass(lines)
+        exports = {k: v for k, v in self.symbol_table.items() if k not in predefined}
+        words, relocs, externals = [], [], {}
+        for i, line in enumerate(cleaned):
+            if not line.startswith("@"):
+                words.append(self.c_instruction(line))
+                continue
+            val = line[1:]
+            if val.isdigit():
+                words.append(_constant(line))
+            elif val in exports:
+                words.append(exports[val])
+                relocs.append(i)
+            elif val in predefined:
+                words.append(self.symbol_table[val])
+            else:
+                words.append(0)
+                externals.setdefault(val, []).append(i)
+        static_prefix = module + "."
+        return {
+            "format": "hobj", "version": ASSEMBLER_VERSION, "module": module,
+            "words": words, "relocs": relocs, "exports": exports,
+            "externals": [
+                [name, "static" if name.startswith(static_prefix) and name[len(static_prefix):].isdigit() else "import", refs]
+                for name, refs in externals.items()
+            ],
+        }
+
+    def assemble_stream(self, lines, out, fmt="hack", header=False):
+        """Single pass: encodes each instruction as it is read.
+
+        Symbols not yet known are parked in `pending` together with the ROM
+        addresses that reference them. A later (LABEL) patches those words in
+        the in-memory ROM buffer; whatever is still pending at the end becomes
+        a variable, in order of first appearance, exactly as the two-pass path
+        assigns them. The buffer is written to the binary file `out` once, at
+        the end. As with write_rom, `header` only applies to "bin" output.
+        """
+        rom = array('H')
+        emit = rom.append
+        symbols = self.symbol_table
+        cache = self.cache
+        cached = cache.words.get
+        touch = cache.words.move_to_end
+        hits = 0
+        pending = {}
+        for line in lines:
+            cleaned = self.clean_line(line)
+            if not cleaned:
+                continue
+            if cleaned.startswith("(") and cleaned.endswith(")"):
+                label = cleaned[1:-1]
+                symbols[label] = len(rom)
+                for ref in pending.pop(label, ()):
+                    rom[ref] = len(rom)
+                continue
+            if cleaned.startswith("@"):
+                val = cleaned[1:]
+                if val.isdigit():
+                    emit(_constant(cleaned))
+                elif val in symbols:
+                    emit(symbols[val])
+                else:
+                    pending.setdefault(val, []).append(len(rom))
+                    emit(0)
+            else:
+                word = cached(cleaned)
+                if word is None:
+                    word = cache.miss(cleaned, self._encode_c)
+                else:
+                    hits += 1
+                    touch(cleaned)
+                emit(word)
+        cache.hits += hits
+
+        # Unresolved symbols are variables.
+        for val, refs in pending.items():
+            symbols[val] = self.variable_address
+            for ref in refs:
+                rom[ref] = self.variable_address
+            self.variable_address += 1
+        out.write(rom_bytes(rom, header) if fmt == "bin" else hack_text(rom).encode())
+        return len(rom)
+
+_encoding_cache = EncodingCache()
+_rom_cache = RomCache()
+
+def assemble(source, cache=None):
+    """Assembles one program, given as text or as an iterable of lines.
+
+    Returns the ROM as an array('H') of 16-bit words. Nothing is read from or
+    written to disk; pass an EncodingCache to keep its statistics separate.
+    """
+    lines = source.splitlines() if isinstance(source, str) else source
+    assembler = Assembler(cache)
+    return assembler.second_pass(assembler.first_pass(lines))
+
+def assemble_many(sources, cache=None):
+    """Yields the ROM of each program in `sources`, see assemble()."""
+    for source in sources:
+        yield assemble(source, cache)
+
+
+# Per-process state of a parallel_second_pass worker, set by _init_worker.
+_worker = None
+
+def _init_worker(symbol_table, cache_size):
+    global _worker
+    _worker = Assembler(EncodingCache(cache_size))
+    _worker.symbol_table = symbol_table
+
+def _encode_chunk(lines):
+    """Encodes one chunk; returns its words and the cache counters it added."""
+    cache = _worker.cache
+    before = cache.hits, cache.misses, cache.evictions
+    packed = _worker.second_pass(lines).tobytes()
+    return (packed, cache.hits - before[0], cache.misses - before[1],
+            cache.evictions - before[2])
+
+def link(objects):
+    """Merges relocatable objects, in order, into one ROM buffer.
+
+    Modules are placed back to back from address 0, so the bootstrap module
+    must come first. Imports resolve to another module's export; a label
+    exported by more than one module can only be used inside those modules.
+    Anything left over is a variable and gets RAM from 16 upward, in order of
+    first appearance, as the single-file assembler would assign it.
+    """
+    exports, ambiguous, base = {}, set(), 0
+    for obj in objects:
+        for name, offset in obj["exports"].items():
+            if name in exports:
+                ambiguous.add(name)
+            exports[name] = base + offset
+        base += len(obj["words"])
+    if base > 32768:
+        print(f"Warning: linked program is {base} words, larger than the 32K ROM")
+
+    rom = array('H')
+    variables, variable_address = {}, 16
+    for obj in objects:
+        words = obj["words"][:]
+        for ref in obj["relocs"]:
+            words[ref] += len(rom)
+        for name, kind, refs in obj["externals"]:
+            if kind == "import" and name in exports:
+                if name in ambiguous:
+                    raise ValueError(f"{obj['module']}: '{name}' is defined by more than one module")
+                address = exports[name]
+            else:
+                if name not in variables:
+                    variables[name] = variable_address
+                    variable_address += 1
+                address = variables[name]
+            for ref in refs:
+                words[ref] = address
+        rom.extend(words)
+    return rom
+
+def source_hash(text):
+    return hashlib.sha1((ASSEMBLER_VERSION + "\0" + text).encode()).hexdigest()
+
+def locate(error, input_file, assembler):
+    """Points an AssemblyError at the first line of input_file holding its instruction."""
+    with open(input_file, 'r') as f:
+        for number, line in enumerate(f, 1):
+            if assembler.clean_line(line) == error.args[0]:
+                error.where = f"{input_file}, line {number}: "
+                return
+
+def compile_object(input_file, cache):
+    """Writes file.hobj next to file.asm unless it is already up to date."""
+    output_file = input_file.replace(".asm", ".hobj")
+    with open(input_file, 'r') as f:
+        text = f.read()
+    digest = source_hash(text)
+    if os.path.exists(output_file):
+        with open(output_file, 'r') as f:
+            obj = json.load(f)
+        if obj.get("source_hash") == digest:
+            print(f"Up to date: {output_file}")
+            return obj
+
+    module = os.path.splitext(os.path.basename(input_file))[0]
+    assembler = Assembler(cache)
+    try:
+        obj = assembler.assemble_object(text.splitlines(), module)
+    except AssemblyError as e:
+        locate(e, input_file, assembler)
+        raise
+    obj["source_hash"] = digest
+    with open(output_file, 'w') as f:
+        json.dump(obj, f, separators=(",", ":"))
+    print(f"Assembly successful. Generated {output_file}")
+    return obj
+
+def write_rom(output_file, rom, args):
+    if args.format == "bin":
+        with open(output_file, 'wb') as f:
+            f.write(rom_bytes(rom, args.header))
+    else:
+        with open(output_file, 'w') as f:
+            f.write(hack_text(rom))
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python Assembler.py file.asm")
-        return
+    parser = argparse.ArgumentParser(description="Hack assembler")
+    parser.add_argument("files", nargs="+", metavar="file", help="file.asm")
+    parser.add_argument("--stream", action="store_true",
+                        help="single pass over the input with label backpatching")
+    parser.add_argument("--format", choices=["hack", "bin"], default="hack",
+                        help="hack: text words (default); bin: raw little-endian 16-bit words")
+    parser.add_argument("--header", action="store_true",
+                        help="prefix bin output with 'HACK' and the word count")
+    parser.add_argument("--cache-size", type=int, default=4096,
+                        help="maximum entries in the C-Instruction cache")
+    parser.add_argument("--stats", action="store_true",
+                        help="print C-Instruction cache statistics")
+    parser.add_argument("-c", "--compile", action="store_true",
+                        help="assemble each file.asm to a relocatable file.hobj (skipped when unchanged)")
+    parser.add_argument("--link", metavar="OUTPUT",
+                        help="link the given .hobj/.asm modules, in order, into OUTPUT")
+    parser.add_argument("--optimize", action="store_true",
+                        help="run the peephole optimizer over each whole program first")
+    parser.add_argument("--rom-cache", metavar="DIR",
+                        help="reuse ROMs of programs assembled before, stored in DIR")
+    parser.add_argument("--rom-cache-size", type=int, default=64, metavar="MB",
+                        help="total size the ROM cache directory is trimmed to (default 64)")
+    parser.add_argument("--parallel-threshold", type=int, default=200000, metavar="N",
+                        help="encode programs of at least N instructions in a process pool")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="worker processes for the parallel second pass (default: CPU count)")
+    args = parser.parse_args()
+    if args.optimize and (args.stream or args.compile or args.link):
+        parser.error("--optimize needs the whole program: it cannot be combined with --stream, -c or --link")
+
+    # One cache for the whole batch: generated files share most of their lines.
+    cache = EncodingCache(args.cache_size)
+    rom_cache = RomCache(args.rom_cache, args.rom_cache_size << 20) if args.rom_cache else None
+    try:
+        run(args, cache, rom_cache)
+    except ValueError as e:  # AssemblyError, or a link error
+        print(f"Error: {e}")
+        sys.exit(1)
+    if args.stats:
+        print(cache.report())
+        if rom_cache is not None:
+            print(f"ROM cache: {rom_cache.hits} hits, {rom_cache.misses} misses")
 
-    input_file = sys.argv[1]
-    output_file = input_file.replace(".asm", ".hack")
+def run(args, cache, rom_cache):
+    """Assembles, compiles or links args.files as the options ask."""
+    if args.link:
+        objects = []
+        for input_file in args.files:
+            if input_file.endswith(".asm"):
+                objects.append(compile_object(input_file, cache))
+            else:
+                with open(input_file, 'r') as f:
+                    objects.append(json.load(f))
+        write_rom(args.link, link(objects), args)
+        print(f"Link successful. Generated {args.link}")
+    else:
+        for input_file in args.files:
+            if args.compile:
+                compile_object(input_file, cache)
+            else:
+                assemble_file(input_file, args, cache, rom_cache)
+
+def assemble_file(input_file, args, cache, rom_cache=None):
+    output_file = input_file.replace(".asm", "." + args.format)
+    assembler = Assembler(cache)
+
+    if args.stream:
+        with open(input_file, 'r') as f, open(output_file, 'wb', buffering=1 << 16) as out:
+            try:
+                assembler.assemble_stream(f, out, args.format, args.header)
+            except AssemblyError as e:
+                locate(e, input_file, assembler)
+                raise
+        print(f"Assembly successful. Generated {output_file}")
+        return
 
     with open(input_file, 'r') as f:
-        lines = f.readlines()
+        lines = [c for c in map(assembler.clean_line, f) if c]
+
+    if rom_cache is not None:
+        key = rom_cache.key(lines, "optimize" if args.optimize else "")
+        rom = rom_cache.get(key)
+        if rom is not None:
+            write_rom(output_file, rom, args)
+            print(f"Assembly cached. Generated {output_file}")
+            return
+
+    if args.optimize:
+        peephole = Peephole()
+        lines = peephole.optimize(lines)
+        print(peephole.report())
 
-    assembler = Assembler()
     # Step 1: Handle Labels
     intermediate_lines = assembler.first_pass(lines)
     # Step 2: Handle Variables and Mnemonics
-    binary_output = assembler.second_pass(intermediate_lines)
-
-    with open(output_file, 'w') as f:
-        f.write("\n".join(binary_output) + "\n")
+    try:
+        if len(intermediate_lines) >= args.parallel_threshold:
+            rom = assembler.parallel_second_pass(intermediate_lines, args.jobs)
+        else:
+            rom = assembler.second_pass(intermediate_lines)
+    except AssemblyError as e:
+        locate(e, input_file, assembler)
+        raise
+    if rom_cache is not None:
+        rom_cache.put(key, rom)
+    write_rom(output_file, rom, args)
 
     print(f"Assembly successful. Generated {output_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,31 @@
+import unittest
+import importlib.util
+from pathlib import Path
+
+# 6.py is not a valid module name for `import`.
+spec = importlib.util.spec_from_file_location("hack_assembler", Path(__file__).with_name("6.py"))
+assembler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(assembler)
+
+
+class ThreadJumpsTest(unittest.TestCase):
+    def optimize(self, lines):
+        return assembler.Peephole().optimize(lines)
+
+    def test_threads_a_plain_jump(self):
+        lines = ["@A", "D;JGT", "@END", "0;JMP", "(A)", "@B", "0;JMP", "(B)", "D=D+1", "(END)"]
+        self.assertIn("@B", self.optimize(lines)[:2])
+
+    def test_keeps_a_jump_that_reads_m(self):
+        # D=M;JGT reads RAM[A]: threading @A to @B would read RAM[B] instead.
+        lines = ["@A", "D=M;JGT", "@END", "0;JMP", "(A)", "@B", "0;JMP", "(B)", "D=D+1", "(END)"]
+        self.assertEqual(self.optimize(lines)[:2], ["@A", "D=M;JGT"])
+
+    def test_keeps_a_jump_that_uses_a(self):
+        for jump in ["A;JEQ", "M=D;JMP", "D=A;JNE"]:
+            lines = ["@A", jump, "@END", "0;JMP", "(A)", "@B", "0;JMP", "(B)", "D=D+1", "(END)"]
+            self.assertEqual(self.optimize(lines)[:2], ["@A", jump], jump)
+
+
+if __name__ == "__main__":
+    unittest.main()
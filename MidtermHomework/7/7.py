@@ -1,41 +1,97 @@
 import sys
 import os
+from enum import IntEnum
+from sys import intern
+
+class Op(IntEnum):
+    C_ARITHMETIC = 0
+    C_PUSH = 1
+    C_POP = 2
+
+OPCODES = {
+    'add': Op.C_ARITHMETIC, 'sub': Op.C_ARITHMETIC, 'neg': Op.C_ARITHMETIC,
+    'eq': Op.C_ARITHMETIC, 'gt': Op.C_ARITHMETIC, 'lt': Op.C_ARITHMETIC,
+    'and': Op.C_ARITHMETIC, 'or': Op.C_ARITHMETIC, 'not': Op.C_ARITHMETIC,
+    'push': Op.C_PUSH, 'pop': Op.C_POP,
+}
+
+# Words a command needs, opcode included; any other command is the opcode alone.
+ARITY = {Op.C_PUSH: 3, Op.C_POP: 3}
+
+class Command:
+    """One decoded VM command: opcode, interned first argument, integer second argument."""
+    __slots__ = ("op", "arg1", "arg2")
+
+    def __init__(self, op, arg1, arg2):
+        self.op = op
+        self.arg1 = arg1
+        self.arg2 = arg2
 
 class Parser:
     """Handles the parsing of a single .vm file."""
     def __init__(self, filename):
+        """Decodes the whole file once; unknown commands are skipped."""
+        self.commands = []
+        decoded = {}  # identical lines share one Command
         with open(filename, 'r') as f:
-            self.lines = [line.split('//')[0].strip() for line in f.readlines() if line.split('//')[0].strip()]
+            for line_number, line in enumerate(f, 1):
+                text = line.split('//')[0].strip()
+                cmd = decoded.get(text)
+                if cmd is None:
+                    words = text.split()
+                    if not words or words[0] not in OPCODES:
+                        continue
+                    op = OPCODES[words[0]]
+                    arity = ARITY.get(op, 1)
+                    if len(words) < arity or (arity == 3 and not words[2].lstrip('-').isdigit()):
+                        raise ValueError(f"{filename}:{line_number}: malformed command '{text}'")
+                    arg1 = intern(words[1] if len(words) > 1 else words[0])
+                    arg2 = int(words[2]) if len(words) > 2 else None
+                    cmd = decoded[text] = Command(op, arg1, arg2)
+                self.commands.append(cmd)
         self.current_line = -1
 
     def has_more_commands(self):
-        return self.current_line + 1 < len(self.lines)
+        return self.current_line + 1 < len(self.commands)
 
     def advance(self):
         self.current_line += 1
-        self.command = self.lines[self.current_line].split()
+        self.command = self.commands[self.current_line]
 
     def command_type(self):
-        arithmetic = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
-        if self.command[0] in arithmetic: return "C_ARITHMETIC"
-        if self.command[0] == 'push': return "C_PUSH"
-        if self.command[0] == 'pop': return "C_POP"
-        return None
+        return self.command.op.name
 
     def arg1(self):
-        if self.command_type() == "C_ARITHMETIC": return self.command[0]
-        return self.command[1]
+        return self.command.arg1
 
     def arg2(self):
-        return int(self.command[2])
+        return self.command.arg2
+
+
+COMPARE_JUMPS = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}
+
+
+def asm_size(asm_path):
+    """Counts the ROM words and the labels in a generated .asm file."""
+    words = labels = 0
+    with open(asm_path, 'r') as f:
+        for line in f:
+            if line.startswith("("):
+                labels += 1
+            elif line.strip() and not line.startswith("//"):
+                words += 1
+    return words, labels
 
 
 class CodeWriter:
     """Translates VM commands into Hack assembly code."""
-    def __init__(self, output_filename):
+    def __init__(self, output_filename, shared_compare=False):
         self.file = open(output_filename, 'w')
         self.filename = os.path.basename(output_filename).replace('.asm', '')
         self.label_count = 0
+        # Route eq/gt/lt through one shared $$EQ / $$GT / $$LT routine each.
+        self.shared_compare = shared_compare
+        self.compare_routines = set()
         self.segments = {
             'local': 'LCL', 'argument': 'ARG', 'this': 'THIS', 'that': 'THAT'
         }
@@ -51,6 +107,11 @@ class CodeWriter:
         elif command in ['neg', 'not']:
             asm += ["@SP", "A=M-1"]
             asm.append("M=-M" if command == 'neg' else "M=!M")
+        elif command in COMPARE_JUMPS and self.shared_compare:
+            label = f"LABEL_{self.label_count}_RET"
+            self.label_count += 1
+            self.compare_routines.add(command)
+            asm += [f"@{label}", "D=A", f"@$${command.upper()}", "0;JMP", f"({label})"]
         elif command in ['eq', 'gt', 'lt']:
             label = f"LABEL_{self.label_count}"
             self.label_count += 1
@@ -90,31 +151,62 @@ class CodeWriter:
 
         self.file.write(f"// {command_type} {segment} {index}\n" + "\n".join(asm) + "\n")
 
+    def write_command(self, cmd):
+        self.WRITERS[cmd.op](self, cmd)
+
+    # Indexed by Op.
+    WRITERS = (
+        lambda self, c: self.write_arithmetic(c.arg1),
+        lambda self, c: self.write_push_pop("C_PUSH", c.arg1, c.arg2),
+        lambda self, c: self.write_push_pop("C_POP", c.arg1, c.arg2),
+    )
+
+    def _write_compare_routine(self, command):
+        """Pops y and x, pushes x <op> y as true (-1) / false (0), returns to the address in D."""
+        name = f"$${command.upper()}"
+        asm = [f"({name})", "@R15", "M=D", "@SP", "AM=M-1", "D=M", "A=A-1", "D=M-D", "M=-1",
+               f"@{name}_RET", f"D;{COMPARE_JUMPS[command]}", "@SP", "A=M-1", "M=0",
+               f"({name}_RET)", "@R15", "A=M", "0;JMP"]
+        self.file.write(f"// {name}\n" + "\n".join(asm) + "\n")
+
     def close(self):
+        if self.compare_routines:
+            # The routines are only entered by a jump; stop the program before them.
+            self.file.write("// end of program\n($$HALT)\n@$$HALT\n0;JMP\n")
+        for command in sorted(self.compare_routines):
+            self._write_compare_routine(command)
         self.file.close()
 
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python VMTranslator.py <file.vm>")
-        return
-
-    path = sys.argv[1]
-    output_path = path.replace('.vm', '.asm')
-    
+def translate(path, output_path, **options):
     parser = Parser(path)
-    writer = CodeWriter(output_path)
+    writer = CodeWriter(output_path, **options)
 
-    while parser.has_more_commands():
-        parser.advance()
-        c_type = parser.command_type()
-        if c_type == "C_ARITHMETIC":
-            writer.write_arithmetic(parser.arg1())
-        elif c_type in ["C_PUSH", "C_POP"]:
-            writer.write_push_pop(c_type, parser.arg1(), parser.arg2())
+    for cmd in parser.commands:
+        writer.write_command(cmd)
 
     writer.close()
+
+
+def main():
+    args = sys.argv[1:]
+    shared_compare = "--shared-compare" in args
+    args = [a for a in args if a != "--shared-compare"]
+    if len(args) != 1:
+        print("Usage: python VMTranslator.py [--shared-compare] <file.vm>")
+        return
+
+    path = args[0]
+    output_path = path.replace('.vm', '.asm')
+    translate(path, output_path, shared_compare=shared_compare)
     print(f"Translation finished. Created {output_path}")
 
+    if shared_compare:
+        translate(path, output_path + ".inline")
+        (words_before, labels_before), (words, labels) = asm_size(output_path + ".inline"), asm_size(output_path)
+        os.remove(output_path + ".inline")
+        print(f"ROM words: {words_before} -> {words} ({words_before - words} saved); "
+              f"labels: {labels_before} -> {labels}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,45 +1,122 @@
+import io
 import os
-import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from enum import IntEnum
+from itertools import repeat
+from sys import intern
+
+TRANSLATOR_VERSION = "1"  # bump when the generated code changes: it invalidates TranslationCache entries
+
+class Op(IntEnum):
+    C_ARITHMETIC = 0
+    C_PUSH = 1
+    C_POP = 2
+    C_LABEL = 3
+    C_GOTO = 4
+    C_IF = 5
+    C_FUNCTION = 6
+    C_CALL = 7
+    C_RETURN = 8
+    # Produced by the Optimizer only, never parsed.
+    C_MOVE = 9
+    C_DISCARD = 10
+
+OPCODES = {
+    'add': Op.C_ARITHMETIC, 'sub': Op.C_ARITHMETIC, 'neg': Op.C_ARITHMETIC,
+    'eq': Op.C_ARITHMETIC, 'gt': Op.C_ARITHMETIC, 'lt': Op.C_ARITHMETIC,
+    'and': Op.C_ARITHMETIC, 'or': Op.C_ARITHMETIC, 'not': Op.C_ARITHMETIC,
+    'push': Op.C_PUSH, 'pop': Op.C_POP, 'label': Op.C_LABEL, 'goto': Op.C_GOTO,
+    'if-goto': Op.C_IF, 'function': Op.C_FUNCTION, 'call': Op.C_CALL, 'return': Op.C_RETURN,
+}
+
+# Words a command needs, opcode included; any other command is the opcode alone.
+ARITY = {Op.C_PUSH: 3, Op.C_POP: 3, Op.C_LABEL: 2, Op.C_GOTO: 2, Op.C_IF: 2,
+         Op.C_FUNCTION: 3, Op.C_CALL: 3}
+
+# Jump taken when x <op> y holds, and when it does not.
+COMPARE_JUMPS = {"eq": ("JEQ", "JNE"), "gt": ("JGT", "JLE"), "lt": ("JLT", "JGE")}
+
+SEG_POINTERS = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+
+# x <op> y into D, with y in D and A pointing at x.
+TOS_BINARY = {"add": "D=D+M", "sub": "D=M-D", "and": "D=D&M", "or": "D=D|M",
+              "eq": "D=M-D", "gt": "D=M-D", "lt": "D=M-D"}
+
+class Command:
+    """One decoded VM command: opcode, interned first argument, integer second argument.
+
+    A C_MOVE carries its push and pop Commands as arg1 and arg2.
+    """
+    __slots__ = ("op", "arg1", "arg2")
+
+    def __init__(self, op, arg1, arg2):
+        self.op = op
+        self.arg1 = arg1
+        self.arg2 = arg2
 
 class Parser:
     def __init__(self, filename):
+        """Decodes the whole file once; unknown commands are skipped."""
+        self.commands = []
+        decoded = {}  # VM code repeats itself: identical lines share one Command
         with open(filename, 'r') as f:
-            self.lines = [line.split('//')[0].strip() for line in f if line.split('//')[0].strip()]
+            for line_number, line in enumerate(f, 1):
+                text = line.split('//')[0].strip()
+                cmd = decoded.get(text)
+                if cmd is None:
+                    words = text.split()
+                    if not words or words[0] not in OPCODES:
+                        continue
+                    op = OPCODES[words[0]]
+                    arity = ARITY.get(op, 1)
+                    if len(words) < arity or (arity == 3 and not words[2].lstrip('-').isdigit()):
+                        raise ValueError(f"{filename}:{line_number}: malformed command '{text}'")
+                    arg1 = intern(words[1] if len(words) > 1 else words[0])
+                    arg2 = int(words[2]) if len(words) > 2 else None
+                    cmd = decoded[text] = Command(op, arg1, arg2)
+                self.commands.append(cmd)
         self.current_command = None
         self.line_ptr = -1
 
     def has_more_commands(self):
-        return self.line_ptr < len(self.lines) - 1
+        return self.line_ptr < len(self.commands) - 1
 
     def advance(self):
         self.line_ptr += 1
-        self.current_command = self.lines[self.line_ptr].split()
+        self.current_command = self.commands[self.line_ptr]
 
     def command_type(self):
-        cmd = self.current_command[0]
-        arithmetic = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
-        if cmd in arithmetic: return "C_ARITHMETIC"
-        if cmd == 'push': return "C_PUSH"
-        if cmd == 'pop': return "C_POP"
-        if cmd == 'label': return "C_LABEL"
-        if cmd == 'goto': return "C_GOTO"
-        if cmd == 'if-goto': return "C_IF"
-        if cmd == 'function': return "C_FUNCTION"
-        if cmd == 'call': return "C_CALL"
-        if cmd == 'return': return "C_RETURN"
+        return self.current_command.op.name
 
     def arg1(self):
-        if self.command_type() == "C_ARITHMETIC": return self.current_command[0]
-        return self.current_command[1]
+        return self.current_command.arg1
 
     def arg2(self):
-        return int(self.current_command[2])
+        return self.current_command.arg2
 
 class CodeWriter:
-    def __init__(self, output_filename):
-        self.file = open(output_filename, 'w')
+    def __init__(self, output_filename, trampolines=False, shared_compare=False, tos_cache=False, call_info=()):
+        # A path, or an already open text stream such as io.StringIO.
+        self.file = open(output_filename, 'w') if isinstance(output_filename, str) else output_filename
+        # Route call/return through one shared $$CALL / $$RETURN routine.
+        self.trampolines = trampolines
+        self.needs_trampolines = False
+        # Route eq/gt/lt through one shared $$EQ / $$GT / $$LT routine each.
+        self.shared_compare = shared_compare
+        self.compare_routines = set()
+        # Keep the top of the stack in D until something needs it in RAM.
+        self.tos_cache = tos_cache
+        self.d_is_tos = False
+        # Function -> (nArgs, registers its light frame saves, or None): see analyze_calls.
+        self.call_info = {name: (num_args, saves) for name, num_args, saves in call_info}
+        self.light_saves = None  # the current function's, if it has a light frame
+        self.pending = []  # assembly lines not yet written to self.file
         self.filename = ""
         self.label_count = 0
+        self.label_ns = ""  # e.g. "Main$" so per-class .asm files can be linked together
         self.current_function = "GLOBAL"
 
     def set_filename(self, filename):
@@ -55,7 +132,12 @@ class CodeWriter:
 
     def write_arithmetic(self, command):
         self._write_asm([f"// {command}"])
-        if command in ['add', 'sub', 'and', 'or', 'eq', 'gt', 'lt']:
+        if command in COMPARE_JUMPS and self.shared_compare:
+            self._spill()
+            self._write_shared_compare(command)
+        elif self.tos_cache:
+            self._write_tos_arithmetic(command)
+        elif command in ['add', 'sub', 'and', 'or', 'eq', 'gt', 'lt']:
             self._pop_stack_to_d() # y
             self._write_asm(["@SP", "AM=M-1"]) # Point to x and decrement SP
             if command == 'add': self._write_asm(["M=D+M"])
@@ -63,8 +145,8 @@ class CodeWriter:
             elif command == 'and': self._write_asm(["M=D&M"])
             elif command == 'or': self._write_asm(["M=D|M"])
             elif command in ['eq', 'gt', 'lt']:
-                label_true = f"TRUE_{self.label_count}"
-                label_end = f"END_ARITH_{self.label_count}"
+                label_true = f"{self.label_ns}TRUE_{self.label_count}"
+                label_end = f"{self.label_ns}END_ARITH_{self.label_count}"
                 self.label_count += 1
                 self._write_asm(["D=M-D", f"@{label_true}"])
                 if command == 'eq': self._write_asm(["D;JEQ"])
@@ -77,57 +159,150 @@ class CodeWriter:
             if command == 'neg': self._write_asm(["M=-M"])
             elif command == 'not': self._write_asm(["M=!M"])
 
+    def _write_tos_arithmetic(self, command):
+        if command in ['neg', 'not']:
+            if not self.d_is_tos:
+                self._write_asm(["@SP", "A=M-1", "M=-M" if command == 'neg' else "M=!M"])
+                return
+            self._write_asm(["D=-D" if command == 'neg' else "D=!D"])
+            return
+        self._take_top()  # y
+        self._write_asm(["@SP", "AM=M-1", TOS_BINARY[command]])
+        if command in COMPARE_JUMPS:
+            label_true = f"{self.label_ns}TRUE_{self.label_count}"
+            label_end = f"{self.label_ns}END_ARITH_{self.label_count}"
+            self.label_count += 1
+            self._write_asm([f"@{label_true}", f"D;{COMPARE_JUMPS[command][False]}", "D=0", f"@{label_end}",
+                             "0;JMP", f"({label_true})", "D=-1", f"({label_end})"])
+        self._push_result()
+
+    def _write_shared_compare(self, command):
+        ret_label = f"{self.label_ns}RET_ADDR_{self.label_count}"
+        self.label_count += 1
+        self.compare_routines.add(command)
+        self._write_asm([f"@{ret_label}", "D=A", f"@$${command.upper()}", "0;JMP", f"({ret_label})"])
+
+    def write_compare_branch(self, command, negate, label):
+        """eq/gt/lt [not] if-goto, fused: jumps on the comparison, no true/false value is built."""
+        jump = COMPARE_JUMPS[command][negate]
+        self._write_asm([f"// {command}{' not' if negate else ''} if-goto {label}"])
+        if self.tos_cache:
+            self._take_top()
+            self._write_asm(["@SP", "AM=M-1", "D=M-D"])
+        else:
+            self._write_asm(["@SP", "AM=M-1", "D=M", "A=A-1", "D=M-D", "@SP", "M=M-1"])
+        self._write_asm([f"@{self.current_function}${label}", f"D;{jump}"])
+
     def write_push_pop(self, command_type, segment, index):
         self._write_asm([f"// {command_type} {segment} {index}"])
         if command_type == "C_PUSH":
-            if segment == "constant":
+            self._spill()
+            self._load_d(segment, index)
+            self._push_result()
+        elif segment in SEG_POINTERS and self.d_is_tos:
+            self._store_tos(SEG_POINTERS[segment], index)
+        elif segment in SEG_POINTERS:
+            self._write_asm([f"@{SEG_POINTERS[segment]}", "D=M", f"@{index}", "D=D+A", "@R13", "M=D"])
+            self._pop_stack_to_d()
+            self._write_asm(["@R13", "A=M", "M=D"])
+        else:
+            self._take_top()
+            self._store_d(segment, index)
+
+    def write_move(self, src, dst):
+        """push src; pop dst without touching the stack."""
+        if self.tos_cache:
+            # Already stack-free here, and the plain pair does not have to spill D first.
+            self.write_push_pop("C_PUSH", src.arg1, src.arg2)
+            self.write_push_pop("C_POP", dst.arg1, dst.arg2)
+            return
+        self._write_asm([f"// move {src.arg1} {src.arg2} -> {dst.arg1} {dst.arg2}"])
+        if dst.arg1 in SEG_POINTERS:
+            self._write_asm([f"@{SEG_POINTERS[dst.arg1]}", "D=M", f"@{dst.arg2}", "D=D+A", "@R13", "M=D"])
+            self._load_d(src.arg1, src.arg2)
+            self._write_asm(["@R13", "A=M", "M=D"])
+        else:
+            self._load_d(src.arg1, src.arg2)
+            self._store_d(dst.arg1, dst.arg2)
+
+    def write_discard(self):
+        if self.d_is_tos:
+            self._write_asm(["// discard"])
+            self.d_is_tos = False
+            return
+        self._write_asm(["// discard", "@SP", "M=M-1"])
+
+    def _store_tos(self, pointer, index):
+        """pop pointer[index] with the value in D: no stack traffic at all."""
+        self.d_is_tos = False
+        if index <= 3:
+            self._write_asm([f"@{pointer}", "A=M"] + ["A=A+1"] * index + ["M=D"])
+            return
+        self._write_asm(["@R13", "M=D", f"@{pointer}", "D=M", f"@{index}", "D=D+A", "@R14", "M=D",
+                         "@R13", "D=M", "@R14", "A=M", "M=D"])
+
+    def _load_d(self, segment, index):
+        if segment == "constant":
+            if index >= 0:
                 self._write_asm([f"@{index}", "D=A"])
-            elif segment in ["local", "argument", "this", "that"]:
-                seg_map = {"local":"LCL", "argument":"ARG", "this":"THIS", "that":"THAT"}
-                self._write_asm([f"@{seg_map[segment]}", "D=M", f"@{index}", "A=D+A", "D=M"])
-            elif segment == "temp":
-                self._write_asm([f"@{5+index}", "D=M"])
-            elif segment == "pointer":
-                self._write_asm([f"@{'THIS' if index == 0 else 'THAT'}", "D=M"])
-            elif segment == "static":
-                self._write_asm([f"@{self.filename}.{index}", "D=M"])
-            self._push_d_to_stack()
-        else: # C_POP
-            if segment in ["local", "argument", "this", "that"]:
-                seg_map = {"local":"LCL", "argument":"ARG", "this":"THIS", "that":"THAT"}
-                self._write_asm([f"@{seg_map[segment]}", "D=M", f"@{index}", "D=D+A", "@R13", "M=D"])
-                self._pop_stack_to_d()
-                self._write_asm(["@R13", "A=M", "M=D"])
-            elif segment == "temp":
-                self._pop_stack_to_d()
-                self._write_asm([f"@{5+index}", "M=D"])
-            elif segment == "pointer":
-                self._pop_stack_to_d()
-                self._write_asm([f"@{'THIS' if index == 0 else 'THAT'}", "M=D"])
-            elif segment == "static":
-                self._pop_stack_to_d()
-                self._write_asm([f"@{self.filename}.{index}", "M=D"])
+            elif index == -1:  # only the optimizer produces negative constants
+                self._write_asm(["D=-1"])
+            else:
+                self._write_asm([f"@{-index}", "D=-A"])
+        elif segment in SEG_POINTERS:
+            self._write_asm([f"@{SEG_POINTERS[segment]}", "D=M", f"@{index}", "A=D+A", "D=M"])
+        elif segment == "temp":
+            self._write_asm([f"@{5+index}", "D=M"])
+        elif segment == "pointer":
+            self._write_asm([f"@{'THIS' if index == 0 else 'THAT'}", "D=M"])
+        elif segment == "static":
+            self._write_asm([f"@{self.filename}.{index}", "D=M"])
+
+    def _store_d(self, segment, index):
+        """temp, pointer and static only; the other segments go through R13."""
+        if segment == "temp":
+            self._write_asm([f"@{5+index}", "M=D"])
+        elif segment == "pointer":
+            self._write_asm([f"@{'THIS' if index == 0 else 'THAT'}", "M=D"])
+        elif segment == "static":
+            self._write_asm([f"@{self.filename}.{index}", "M=D"])
 
     def write_label(self, label):
+        self._spill()  # every jump here arrives with the whole stack in RAM
         self._write_asm([f"({self.current_function}${label})"])
 
     def write_goto(self, label):
+        self._spill()
         self._write_asm([f"@{self.current_function}${label}", "0;JMP"])
 
     def write_if(self, label):
-        self._pop_stack_to_d()
+        self._take_top()
         self._write_asm([f"@{self.current_function}${label}", "D;JNE"])
 
     def write_function(self, function_name, num_locals):
         self.current_function = function_name
+        self.light_saves = self.call_info.get(function_name, (None, None))[1]
+        self._spill()
         self._write_asm([f"({function_name})"])
         for _ in range(num_locals):
+            self._spill()
             self._write_asm(["@0", "D=A"])
-            self._push_d_to_stack()
+            self._push_result()
 
     def write_call(self, function_name, num_args):
-        ret_label = f"RET_ADDR_{self.label_count}"
+        self._spill()
+        ret_label = f"{self.label_ns}RET_ADDR_{self.label_count}"
         self.label_count += 1
+        saves = self.call_info.get(function_name, (None, None))[1]
+        if saves:
+            self._write_light_call(function_name, num_args, saves, ret_label)
+            return
+        if self.trampolines:
+            # R13 = nArgs, R14 = target, D = return address
+            self.needs_trampolines = True
+            self._write_asm([f"@{num_args}", "D=A", "@R13", "M=D", f"@{function_name}", "D=A", "@R14", "M=D",
+                             f"@{ret_label}", "D=A", "@$$CALL", "0;JMP", f"({ret_label})"])
+            return
         self._write_asm([f"@{ret_label}", "D=A"])
         self._push_d_to_stack()
         for seg in ["LCL", "ARG", "THIS", "THAT"]:
@@ -135,51 +310,621 @@ class CodeWriter:
             self._push_d_to_stack()
         self._write_asm(["@SP", "D=M", "@5", "D=D-A", f"@{num_args}", "D=D-A", "@ARG", "M=D", "@SP", "D=M", "@LCL", "M=D", f"@{function_name}", "0;JMP", f"({ret_label})"])
 
+    def _write_light_call(self, function_name, num_args, saves, ret_label):
+        """Frame: return address, then only the registers the leaf callee changes."""
+        self._write_asm([f"// call {function_name} {num_args} (light frame: {' '.join(saves)})",
+                         f"@{ret_label}", "D=A"])
+        self._push_d_to_stack()
+        for seg in saves:
+            self._write_asm([f"@{seg}", "D=M"])
+            self._push_d_to_stack()
+        self._write_asm(["@SP", "D=M", f"@{num_args + 1 + len(saves)}", "D=D-A", "@ARG", "M=D"])
+        if "LCL" in saves:
+            self._write_asm(["@SP", "D=M", "@LCL", "M=D"])
+        self._write_asm([f"@{function_name}", "0;JMP", f"({ret_label})"])
+
+    def _write_light_return(self):
+        num_args, saves = self.call_info[self.current_function]
+        self._write_asm(["// return (light frame)"])
+        self._take_top()
+        self._write_asm(["@R15", "M=D", "@ARG", "D=M"] + ([f"@{num_args}", "D=D+A"] if num_args else []) +
+                        ["@R13", "M=D", "A=D", "D=M", "@R14", "M=D",  # R13 = frame, R14 = return address
+                         "@R15", "D=M", "@ARG", "A=M", "M=D", "@ARG", "D=M+1", "@SP", "M=D"])
+        for i, seg in enumerate(saves, 1):
+            self._write_asm(["@R13", "D=M", f"@{i}", "A=D+A", "D=M", f"@{seg}", "M=D"])
+        self._write_asm(["@R14", "A=M", "0;JMP"])
+
+    def can_tail_call(self, function_name, num_args):
+        """call f n; return can reuse this frame when it was built for the same n and f needs a full frame."""
+        current = self.call_info.get(self.current_function)
+        callee = self.call_info.get(function_name, (None, None))
+        return current is not None and current[0] == num_args and not self.light_saves and not callee[1]
+
+    def write_tail_call(self, function_name, num_args):
+        """Moves the arguments over ours, drops our locals and jumps: f returns straight to our caller."""
+        self._spill()
+        self._write_asm([f"// call {function_name} {num_args}; return (tail call)"])
+        if num_args:
+            self._write_asm(["@ARG", "D=M", "@R13", "M=D", "@SP", "D=M", f"@{num_args}", "D=D-A", "@R14", "M=D"])
+            for _ in range(num_args):
+                self._write_asm(["@R14", "A=M", "D=M", "@R14", "M=M+1", "@R13", "A=M", "M=D", "@R13", "M=M+1"])
+        self._write_asm(["@LCL", "D=M", "@SP", "M=D", f"@{function_name}", "0;JMP"])
+
     def write_return(self):
+        if self.light_saves:
+            self._write_light_return()
+            return
+        if self.trampolines:
+            self._spill()
+            self.needs_trampolines = True
+            self._write_asm(["@$$RETURN", "0;JMP"])
+            return
+        if self.d_is_tos:
+            # Park the return value: *ARG may be the return address slot, read below.
+            self.d_is_tos = False
+            self._write_asm(["@R15", "M=D"])
+            self._write_return(["@R15", "D=M"])
+            return
+        self._write_return()
+
+    def _write_return(self, load_value=None):
         self._write_asm(["@LCL", "D=M", "@R13", "M=D", "@5", "A=D-A", "D=M", "@R14", "M=D"])
-        self._pop_stack_to_d()
+        if load_value:
+            self._write_asm(load_value)
+        else:
+            self._pop_stack_to_d()
         self._write_asm(["@ARG", "A=M", "M=D", "@ARG", "D=M+1", "@SP", "M=D"])
         for i, seg in enumerate(["THAT", "THIS", "ARG", "LCL"]):
             self._write_asm(["@R13", "AM=M-1", "D=M", f"@{seg}", "M=D"])
         self._write_asm(["@R14", "A=M", "0;JMP"])
 
+    def _write_compare_routine(self, command):
+        """Pops y and x, pushes x <op> y as true (-1) / false (0), returns to D."""
+        name = f"$${command.upper()}"
+        self._write_asm([f"// {name}: x {command} y, returns to the address in D",
+                         f"({name})", "@R15", "M=D", "@SP", "AM=M-1", "D=M", "A=A-1", "D=M-D", "M=-1",
+                         f"@{name}_RET", f"D;{COMPARE_JUMPS[command][False]}", "@SP", "A=M-1", "M=0",
+                         f"({name}_RET)", "@R15", "A=M", "0;JMP"])
+
+    def _write_trampolines(self):
+        """The shared call/return routines; only ever entered by a jump."""
+        self._write_asm(["// $$CALL: push return address (D) and the caller's frame, jump to R14",
+                         "($$CALL)", "@SP", "AM=M+1", "A=A-1", "M=D"])
+        for seg in ["LCL", "ARG", "THIS", "THAT"]:
+            self._write_asm([f"@{seg}", "D=M", "@SP", "AM=M+1", "A=A-1", "M=D"])
+        self._write_asm(["@SP", "D=M", "@5", "D=D-A", "@R13", "D=D-M", "@ARG", "M=D",
+                         "@SP", "D=M", "@LCL", "M=D", "@R14", "A=M", "0;JMP"])
+        self._write_asm(["// $$RETURN", "($$RETURN)"])
+        self._write_return()
+
     def _push_d_to_stack(self):
         self._write_asm(["@SP", "A=M", "M=D", "@SP", "M=M+1"])
 
     def _pop_stack_to_d(self):
         self._write_asm(["@SP", "AM=M-1", "D=M"])
 
+    def _push_result(self):
+        """Pushes D, or with tos_cache just remembers that D is the top of the stack."""
+        if self.tos_cache:
+            self.d_is_tos = True
+        else:
+            self._push_d_to_stack()
+
+    def _take_top(self):
+        """Pops the top of the stack into D, wherever it is."""
+        if self.d_is_tos:
+            self.d_is_tos = False
+        else:
+            self._pop_stack_to_d()
+
+    def _spill(self):
+        """Writes a top of stack held in D back to RAM, before D is needed for anything else."""
+        if self.d_is_tos:
+            self.d_is_tos = False
+            self._push_d_to_stack()
+
     def _write_asm(self, insts):
-        for i in insts: self.file.write(i + "\n")
+        self.pending.extend(insts)
+        if len(self.pending) > 4096:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.pending.append("")
+            self.file.write("\n".join(self.pending))
+            self.pending = []
+
+    def write_command(self, cmd):
+        self.WRITERS[cmd.op](self, cmd)
+
+    # Indexed by Op.
+    WRITERS = (
+        lambda self, c: self.write_arithmetic(c.arg1),
+        lambda self, c: self.write_push_pop("C_PUSH", c.arg1, c.arg2),
+        lambda self, c: self.write_push_pop("C_POP", c.arg1, c.arg2),
+        lambda self, c: self.write_label(c.arg1),
+        lambda self, c: self.write_goto(c.arg1),
+        lambda self, c: self.write_if(c.arg1),
+        lambda self, c: self.write_function(c.arg1, c.arg2),
+        lambda self, c: self.write_call(c.arg1, c.arg2),
+        lambda self, c: self.write_return(),
+        lambda self, c: self.write_move(c.arg1, c.arg2),
+        lambda self, c: self.write_discard(),
+    )
+
+    def finish_file(self):
+        """Writes out everything translated so far, without the end-of-program routines."""
+        self._spill()
+        self._flush()
+
+    def write_translated(self, text, compare_routines, needs_trampolines):
+        """Appends the code of a file translated by its own CodeWriter (see translate_file)."""
+        self._flush()
+        self.file.write(text)
+        self.compare_routines |= compare_routines
+        self.needs_trampolines = self.needs_trampolines or needs_trampolines
+
+    def close(self, routines=True):
+        """Writes the end-of-program routines the code needs and closes the file.
 
-    def close(self):
+        With routines=False they are left to another module: the per-class
+        modules of --split import them from Bootstrap.asm.
+        """
+        self._spill()
+        if not routines:
+            self._flush()
+            self.file.close()
+            return
+        if self.needs_trampolines or self.compare_routines:
+            # Shared routines are only entered by a jump; stop a program that runs off its end.
+            self._write_asm(["// end of program", "($$HALT)", "@$$HALT", "0;JMP"])
+        if self.needs_trampolines:
+            self._write_trampolines()
+        for command in sorted(self.compare_routines):
+            self._write_compare_routine(command)
+        self._flush()
         self.file.close()
 
+def _word(value):
+    """Wraps to a signed 16-bit Hack word."""
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+class Optimizer:
+    """Rewrites decoded VM commands into fewer, equivalent ones.
+
+    Constants are folded (`push constant 0; not` becomes `push constant -1`),
+    `push X; pop Y` becomes one stack-free move, and, with scratch_temp0, a
+    store into temp 0 that nothing reads is dropped (a `pop temp 0` only pops).
+    The last rule changes what temp 0 holds when the program stops, which the
+    course tests check, so it is only for Jack programs. Every rule looks at
+    adjacent commands, so nothing moves across a label.
+    """
+    FOLD = {
+        "add": lambda x, y: x + y, "sub": lambda x, y: x - y,
+        "and": lambda x, y: x & y, "or": lambda x, y: x | y,
+        # The generated code compares through x - y, overflow included.
+        "eq": lambda x, y: -1 if _word(x - y) == 0 else 0,
+        "gt": lambda x, y: -1 if _word(x - y) > 0 else 0,
+        "lt": lambda x, y: -1 if _word(x - y) < 0 else 0,
+        "neg": lambda x: -x, "not": lambda x: ~x,
+    }
+    # Commands that end a straight-line block.
+    BLOCK_ENDS = {Op.C_LABEL, Op.C_GOTO, Op.C_IF, Op.C_FUNCTION, Op.C_CALL, Op.C_RETURN}
+
+    def __init__(self, scratch_temp0=False):
+        self.scratch_temp0 = scratch_temp0
+        self.counts = {}
+        self.before = self.after = 0
+
+    def _hit(self, rule):
+        self.counts[rule] = self.counts.get(rule, 0) + 1
+
+    def optimize(self, programs):
+        """Optimizes the command lists of every file of one program, in place."""
+        self.before += sum(len(commands) for commands in programs)
+        temp0_scratch = self.scratch_temp0 and all(self._temp0_is_scratch(commands) for commands in programs)
+        for i, commands in enumerate(programs):
+            commands = self._fuse_moves(self._fold(commands))
+            if temp0_scratch:
+                commands = self._dead_temp0(commands)
+            programs[i] = commands
+        self.after += sum(len(commands) for commands in programs)
+
+    @staticmethod
+    def _constant(cmd):
+        return cmd.op == Op.C_PUSH and cmd.arg1 == "constant"
+
+    def _fold(self, commands):
+        out = []
+        for cmd in commands:
+            fold = self.FOLD.get(cmd.arg1) if cmd.op == Op.C_ARITHMETIC else None
+            arity = 1 if cmd.arg1 in ("neg", "not") else 2
+            if fold and len(out) >= arity and all(self._constant(c) for c in out[-arity:]):
+                value = _word(fold(*(c.arg2 for c in out[-arity:])))
+                if value != -32768:  # not expressible as @k
+                    del out[-arity:]
+                    out.append(Command(Op.C_PUSH, "constant", value))
+                    self._hit("fold")
+                    continue
+            out.append(cmd)
+        return out
+
+    def _fuse_moves(self, commands):
+        out = []
+        for cmd in commands:
+            if cmd.op == Op.C_POP and out and out[-1].op == Op.C_PUSH:
+                out[-1] = Command(Op.C_MOVE, out[-1], cmd)
+                self._hit("move")
+                continue
+            out.append(cmd)
+        return out
+
+    @staticmethod
+    def _temp0_access(cmd):
+        """(reads temp 0, writes temp 0)"""
+        if cmd.op == Op.C_MOVE:
+            src, dst = cmd.arg1, cmd.arg2
+        elif cmd.op in (Op.C_PUSH, Op.C_POP):
+            src, dst = (cmd, None) if cmd.op == Op.C_PUSH else (None, cmd)
+        else:
+            return False, False
+        reads = src is not None and src.arg1 == "temp" and src.arg2 == 0
+        writes = dst is not None and dst.arg1 == "temp" and dst.arg2 == 0
+        return reads, writes
+
+    def _temp0_is_scratch(self, commands):
+        """True when every read of temp 0 follows a write to it in the same block.
+
+        Then no value of temp 0 survives the end of a block, whatever the
+        callers and callees do with it. JackCompiler.py code always qualifies.
+        """
+        written = False
+        for cmd in commands:
+            if cmd.op in self.BLOCK_ENDS:
+                written = False
+                continue
+            reads, writes = self._temp0_access(cmd)
+            if reads and not written:
+                return False
+            written = written or writes
+        return True
+
+    def _dead_temp0(self, commands):
+        out = []
+        for i, cmd in enumerate(commands):
+            if self._temp0_access(cmd)[1] and self._temp0_dead_after(commands, i + 1):
+                if cmd.op == Op.C_MOVE:
+                    self._hit("dead-move")
+                    continue
+                out.append(Command(Op.C_DISCARD, "discard", None))
+                self._hit("dead-pop")
+                continue
+            out.append(cmd)
+        return out
+
+    def _temp0_dead_after(self, commands, i):
+        for cmd in commands[i:]:
+            if cmd.op in self.BLOCK_ENDS:
+                return True
+            reads, writes = self._temp0_access(cmd)
+            if reads:
+                return False
+            if writes:
+                return True
+        return True
+
+    def report(self):
+        rules = ", ".join(f"{rule} {n}" for rule, n in sorted(self.counts.items()))
+        return (f"Optimizer: {self.before} -> {self.after} VM commands; "
+                f"{rules or 'nothing to do'}")
+
+def translate(commands, cw):
+    write = cw.write_command
+    if not cw.shared_compare and not cw.call_info:
+        for cmd in commands:
+            write(cmd)
+        return
+
+    i = 0
+    while i < len(commands):
+        cmd = commands[i]
+        if (cmd.op == Op.C_CALL and i + 1 < len(commands) and commands[i + 1].op == Op.C_RETURN
+                and cw.can_tail_call(cmd.arg1, cmd.arg2)):
+            cw.write_tail_call(cmd.arg1, cmd.arg2)
+            i += 2
+            continue
+        if cw.shared_compare and cmd.op == Op.C_ARITHMETIC and cmd.arg1 in COMPARE_JUMPS:
+            j, negate = i + 1, False
+            if j < len(commands) and commands[j].op == Op.C_ARITHMETIC and commands[j].arg1 == "not":
+                j, negate = j + 1, True
+            if j < len(commands) and commands[j].op == Op.C_IF:
+                cw.write_compare_branch(cmd.arg1, negate, commands[j].arg1)
+                i = j + 1
+                continue
+        write(cmd)
+        i += 1
+
+def asm_size(asm_path):
+    """Counts the ROM words and the labels in a generated .asm file."""
+    words = labels = 0
+    with open(asm_path, 'r') as f:
+        for line in f:
+            if line.startswith("("):
+                labels += 1
+            elif line.strip() and not line.startswith("//"):
+                words += 1
+    return words, labels
+
+def prune_functions(programs, entry="Sys.init"):
+    """Drops every function that entry cannot reach through call commands, in place.
+
+    Returns the names of the dropped functions. Commands before a file's first
+    function are kept. Jack has no function pointers, so `call` is the only
+    way into a function.
+    """
+    bodies = {}  # function name -> its commands, up to the next function
+    for commands in programs:
+        name = None
+        for cmd in commands:
+            if cmd.op == Op.C_FUNCTION:
+                name = cmd.arg1
+                bodies[name] = []
+            elif name is not None:
+                bodies[name].append(cmd)
+    if entry not in bodies:
+        return []
+
+    reachable, todo = {entry}, [entry]
+    while todo:
+        for cmd in bodies[todo.pop()]:
+            if cmd.op == Op.C_CALL and cmd.arg1 not in reachable and cmd.arg1 in bodies:
+                reachable.add(cmd.arg1)
+                todo.append(cmd.arg1)
+
+    for i, commands in enumerate(programs):
+        kept, keep = [], True
+        for cmd in commands:
+            if cmd.op == Op.C_FUNCTION:
+                keep = cmd.arg1 in reachable
+            if keep:
+                kept.append(cmd)
+        programs[i] = kept
+    return sorted(set(bodies) - reachable)
+
+def analyze_calls(programs):
+    """CodeWriter call_info for a whole program: (name, nArgs, light frame or None).
+
+    Only functions that every call passes the same nArgs to are listed. A
+    leaf (it calls nothing) other than Sys.init gets a light frame: the
+    return address plus ARG, LCL only if it has locals, THIS and THAT only if
+    it sets them.
+    """
+    num_args = {"Sys.init": {0}}  # the bootstrap's call
+    bodies = {}  # name -> [calls anything, needs LCL, sets THIS, sets THAT]
+    for commands in programs:
+        body = None
+        for cmd in commands:
+            if cmd.op == Op.C_FUNCTION:
+                body = bodies[cmd.arg1] = [False, cmd.arg2 > 0, False, False]
+            if cmd.op == Op.C_CALL:
+                num_args.setdefault(cmd.arg1, set()).add(cmd.arg2)
+            if body is None:
+                continue
+            if cmd.op == Op.C_CALL:
+                body[0] = True
+            for access in ((cmd.arg1, cmd.arg2) if cmd.op == Op.C_MOVE else (cmd,)):
+                if access.op in (Op.C_PUSH, Op.C_POP) and access.arg1 == "local":
+                    body[1] = True
+                if access.op == Op.C_POP and access.arg1 == "pointer":
+                    body[2 + access.arg2] = True
+
+    info = []
+    for name, counts in sorted(num_args.items()):
+        if len(counts) != 1:
+            continue
+        saves = None
+        body = bodies.get(name)
+        if body and not body[0] and name != "Sys.init":
+            saves = ("ARG",) + tuple(seg for seg, used in zip(("LCL", "THIS", "THAT"), body[1:]) if used)
+        info.append((name, next(iter(counts)), saves))
+    return tuple(info)
+
+def parse_all(vm_files, optimizer=None, prune=False):
+    parsers = [Parser(vf) for vf in vm_files]
+    if prune:
+        programs = [p.commands for p in parsers]
+        before = sum(len(commands) for commands in programs)
+        dropped = prune_functions(programs)
+        for p, commands in zip(parsers, programs):
+            p.commands = commands
+        after = sum(len(commands) for commands in programs)
+        print(f"Pruned {len(dropped)} unreachable functions ({before} -> {after} VM commands)"
+              + (": " + ", ".join(dropped) if dropped else ""))
+    if optimizer:
+        programs = [p.commands for p in parsers]
+        optimizer.optimize(programs)
+        for p, commands in zip(parsers, programs):
+            p.commands = commands
+    return parsers
+
+def translate_file(vm_file, commands, options):
+    """Translates one file on its own, with labels scoped to it.
+
+    Returns its assembly and the shared routines it jumps to; the result does
+    not depend on the other files, so files can be translated in any process.
+    """
+    buffer = io.StringIO()
+    cw = CodeWriter(buffer, **options)
+    cw.set_filename(vm_file)
+    cw.label_ns = f"{cw.filename}$"
+    translate(commands, cw)
+    cw.finish_file()
+    return buffer.getvalue(), cw.compare_routines, cw.needs_trampolines
+
+class TranslationCache:
+    """translate_file results stored as <key>.asm files in a directory.
+
+    The key hashes the translator version, the CodeWriter options, the file
+    name (labels and statics are named after it) and the file's content, or
+    its commands after whole-program passes such as --prune and --optimize.
+    A hit is copied into the output as it is: labels are file-scoped, so the
+    chunk does not depend on the files around it.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(vm_file, data, options):
+        h = hashlib.sha1(f"{TRANSLATOR_VERSION}\0{sorted(options.items())}\0{os.path.basename(vm_file)}\0".encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.directory, key + ".asm"), 'r') as f:
+                header = json.loads(f.readline()[2:])  # "//{...}"
+                text = f.read()
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return text, set(header["compare"]), header["trampolines"]
+
+    def put(self, key, result):
+        text, compare_routines, needs_trampolines = result
+        path = os.path.join(self.directory, key + ".asm")
+        with open(path + ".tmp", 'w') as f:
+            f.write("//" + json.dumps({"compare": sorted(compare_routines), "trampolines": needs_trampolines}) + "\n")
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+def commands_digest(commands):
+    """Bytes that identify a command list, for TranslationCache keys."""
+    def text(cmd):
+        if cmd.op == Op.C_MOVE:
+            return f"{cmd.op} {text(cmd.arg1)} {text(cmd.arg2)}"
+        return f"{cmd.op} {cmd.arg1} {cmd.arg2}"
+    return "\n".join(map(text, commands)).encode()
+
+def build(output_path, vm_files, bootstrap, optimizer=None, prune=False, jobs=1, cache=None,
+          fast_calls=False, **options):
+    programs = keys = None
+    fast_calls = fast_calls and bootstrap  # needs every caller, and Sys.init to start from
+    if optimizer or prune or fast_calls:
+        programs = [p.commands for p in parse_all(vm_files, optimizer, prune)]
+        if fast_calls:
+            options = dict(options, call_info=analyze_calls(programs))
+        if cache:
+            keys = [cache.key(vf, commands_digest(commands), options) for vf, commands in zip(vm_files, programs)]
+    elif cache:
+        # Unchanged files are not even parsed.
+        keys = []
+        for vf in vm_files:
+            with open(vf, 'rb') as f:
+                keys.append(cache.key(vf, f.read(), options))
+
+    cw = CodeWriter(output_path, **options)
+    if bootstrap: cw.write_init()
+
+    results = [cache.get(key) for key in keys] if cache else [None] * len(vm_files)
+    todo = [i for i, result in enumerate(results) if result is None]
+    files = [vm_files[i] for i in todo]
+    commands = [programs[i] for i in todo] if programs else [Parser(vf).commands for vf in files]
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(min(jobs, len(files))) as pool:
+            translated = list(pool.map(translate_file, files, commands, repeat(options)))
+    else:
+        translated = list(map(translate_file, files, commands, repeat(options)))
+    for i, result in zip(todo, translated):
+        results[i] = result
+        if cache:
+            cache.put(keys[i], result)
+
+    for result in results:
+        cw.write_translated(*result)
+    cw.close()
+
 def main():
-    if len(sys.argv) != 2: return
-    path = sys.argv[1].rstrip('/')
+    parser = argparse.ArgumentParser(description="Hack VM translator")
+    parser.add_argument("path", help="file.vm or a directory of .vm files")
+    parser.add_argument("--split", action="store_true",
+                        help="directory mode: write Bootstrap.asm plus one .asm per .vm file, "
+                             "with file-scoped labels, for 6.py -c / --link")
+    parser.add_argument("--trampolines", action="store_true",
+                        help="share one $$CALL/$$RETURN routine instead of inlining every call and return")
+    parser.add_argument("--shared-compare", action="store_true",
+                        help="share one routine per eq/gt/lt, and branch directly when if-goto follows")
+    parser.add_argument("--optimize", action="store_true",
+                        help="fold constants and fuse push/pop pairs first")
+    parser.add_argument("--scratch-temp0", action="store_true",
+                        help="with --optimize: temp 0 is the compiler's scratch (JackCompiler.py output), "
+                             "drop stores into it that are never read")
+    parser.add_argument("--tos-cache", action="store_true",
+                        help="keep the top of the stack in D within straight-line code")
+    parser.add_argument("--prune", action="store_true",
+                        help="directory mode: drop the functions Sys.init can never call")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="directory mode: translate the files in this many processes "
+                             "(default: 1, as starting a pool costs more than a course-size "
+                             "directory takes; 0: CPU count); the output is the same for any value")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse the translation of unchanged .vm files, stored in DIR")
+    parser.add_argument("--fast-calls", action="store_true",
+                        help="directory mode: light frames for leaf functions, and 'call f n; return' "
+                             "reuses the caller's frame")
+    parser.add_argument("--stats", action="store_true",
+                        help="also build plain inline code and compare ROM words and labels with it "
+                             "(a second, uncached translation)")
+    args = parser.parse_args()
+    if args.scratch_temp0 and not args.optimize:
+        parser.error("--scratch-temp0 needs --optimize")
+    options = {"trampolines": args.trampolines, "shared_compare": args.shared_compare,
+               "tos_cache": args.tos_cache}
+    optimizer = Optimizer(args.scratch_temp0) if args.optimize else None
+
+    path = args.path.rstrip('/')
     is_dir = os.path.isdir(path)
     output_path = f"{path}/{os.path.basename(path)}.asm" if is_dir else path.replace(".vm", ".asm")
-    vm_files = [f"{path}/{f}" for f in os.listdir(path) if f.endswith('.vm')] if is_dir else [path]
-
-    cw = CodeWriter(output_path)
-    if is_dir: cw.write_init()
-
-    for vf in vm_files:
-        p = Parser(vf)
-        cw.set_filename(vf)
-        while p.has_more_commands():
-            p.advance()
-            t = p.command_type()
-            if t == "C_ARITHMETIC": cw.write_arithmetic(p.arg1())
-            elif t in ["C_PUSH", "C_POP"]: cw.write_push_pop(t, p.arg1(), p.arg2())
-            elif t == "C_LABEL": cw.write_label(p.arg1())
-            elif t == "C_GOTO": cw.write_goto(p.arg1())
-            elif t == "C_IF": cw.write_if(p.arg1())
-            elif t == "C_FUNCTION": cw.write_function(p.arg1(), p.arg2())
-            elif t == "C_CALL": cw.write_call(p.arg1(), p.arg2())
-            elif t == "C_RETURN": cw.write_return()
-    cw.close()
+    # Sorted, so the output does not depend on the directory order.
+    vm_files = sorted(f"{path}/{f}" for f in os.listdir(path) if f.endswith('.vm')) if is_dir else [path]
+
+    if is_dir and args.split:
+        parsers = parse_all(vm_files, optimizer, args.prune)
+        if args.fast_calls:
+            options["call_info"] = analyze_calls([p.commands for p in parsers])
+        boot = CodeWriter(f"{path}/Bootstrap.asm", **options)
+        boot.label_ns = "Bootstrap$"
+        boot.write_init()
+        for vf, p in zip(vm_files, parsers):
+            cw = CodeWriter(vf.replace(".vm", ".asm"), **options)
+            cw.set_filename(vf)
+            cw.label_ns = f"{cw.filename}$"
+            translate(p.commands, cw)
+            cw.close(routines=False)
+            # One copy of each shared routine, in Bootstrap.asm, for the whole image.
+            boot.compare_routines |= cw.compare_routines
+            boot.needs_trampolines = boot.needs_trampolines or cw.needs_trampolines
+        boot.close()
+        if optimizer: print(optimizer.report())
+        return
+
+    jobs = args.jobs or os.cpu_count() or 1  # -j 0: one per CPU
+    cache = TranslationCache(args.cache) if args.cache else None
+    build(output_path, vm_files, is_dir, optimizer, args.prune and is_dir, jobs, cache, args.fast_calls, **options)
+    if cache: print(f"Translation cache: {cache.hits} hits, {cache.misses} misses")
+    if optimizer: print(optimizer.report())
+
+    if args.stats:
+        baseline = output_path + ".inline"
+        build(baseline, vm_files, is_dir)
+        (words_before, labels_before), (words, labels) = asm_size(baseline), asm_size(output_path)
+        os.remove(baseline)
+        print(f"ROM words: {words_before} -> {words} ({words_before - words} saved); "
+              f"labels: {labels_before} -> {labels}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
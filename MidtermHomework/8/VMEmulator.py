@@ -0,0 +1,1046 @@
+import os
+import re
+import sys
+import time
+import math
+import argparse
+import importlib.util
+from collections import deque
+from array import array
+
+def _load_tool(name, path):
+    """Imports a sibling course tool by path (8.py: not a valid module name)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+translator = _load_tool("vm_translator", os.path.join(os.path.dirname(os.path.abspath(__file__)), "8.py"))
+Op = translator.Op
+_word = translator._word
+
+# Decoded opcodes. Labels are resolved away and do not take a step.
+(PUSH_CONST, PUSH_IND, PUSH_DIR, POP_IND, POP_DIR, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ GOTO, IF_GOTO, FUNCTION, CALL, RETURN, HALT) = range(20)
+
+ARITHMETIC = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT,
+              "and": AND, "or": OR, "not": NOT}
+# Segments addressed through a pointer at RAM[1..4].
+SEG_POINTERS = {"local": 1, "argument": 2, "this": 3, "that": 4}
+TST_POINTERS = {"sp": 0, "local": 1, "argument": 2, "this": 3, "that": 4}
+
+RAM_SIZE = 32768
+SCREEN, KBD = 16384, 24576
+STATIC_BASE = 16
+TEXT_ROWS, TEXT_COLUMNS = 23, 64
+NEW_LINE, BACKSPACE = 128, 129
+
+# 11 rows of 8 pixels per character, bit 0 leftmost: the book's Output font.
+# Code 0 is the black square shown for characters outside 32..126.
+FONT = {
+    0: (63, 63, 63, 63, 63, 63, 63, 63, 63, 0, 0),  # black square
+    32: (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),  # ' '
+    33: (12, 30, 30, 30, 12, 12, 0, 12, 12, 0, 0),  # '!'
+    34: (54, 54, 20, 0, 0, 0, 0, 0, 0, 0, 0),  # '"'
+    35: (0, 18, 18, 63, 18, 18, 63, 18, 18, 0, 0),  # '#'
+    36: (12, 30, 51, 3, 30, 48, 51, 30, 12, 12, 0),  # '$'
+    37: (0, 0, 35, 51, 24, 12, 6, 51, 49, 0, 0),  # '%'
+    38: (12, 30, 30, 12, 54, 27, 27, 27, 54, 0, 0),  # '&'
+    39: (12, 12, 6, 0, 0, 0, 0, 0, 0, 0, 0),  # "'"
+    40: (24, 12, 6, 6, 6, 6, 6, 12, 24, 0, 0),  # '('
+    41: (6, 12, 24, 24, 24, 24, 24, 12, 6, 0, 0),  # ')'
+    42: (0, 0, 0, 51, 30, 63, 30, 51, 0, 0, 0),  # '*'
+    43: (0, 0, 0, 12, 12, 63, 12, 12, 0, 0, 0),  # '+'
+    44: (0, 0, 0, 0, 0, 0, 0, 12, 12, 6, 0),  # ','
+    45: (0, 0, 0, 0, 0, 63, 0, 0, 0, 0, 0),  # '-'
+    46: (0, 0, 0, 0, 0, 0, 0, 12, 12, 0, 0),  # '.'
+    47: (0, 0, 32, 48, 24, 12, 6, 3, 1, 0, 0),  # '/'
+    48: (12, 30, 51, 51, 51, 51, 51, 30, 12, 0, 0),  # '0'
+    49: (12, 14, 15, 12, 12, 12, 12, 12, 63, 0, 0),  # '1'
+    50: (30, 51, 48, 24, 12, 6, 3, 51, 63, 0, 0),  # '2'
+    51: (30, 51, 48, 48, 28, 48, 48, 51, 30, 0, 0),  # '3'
+    52: (16, 24, 28, 26, 25, 63, 24, 24, 60, 0, 0),  # '4'
+    53: (63, 3, 3, 31, 48, 48, 48, 51, 30, 0, 0),  # '5'
+    54: (28, 6, 3, 3, 31, 51, 51, 51, 30, 0, 0),  # '6'
+    55: (63, 49, 48, 48, 24, 12, 12, 12, 12, 0, 0),  # '7'
+    56: (30, 51, 51, 51, 30, 51, 51, 51, 30, 0, 0),  # '8'
+    57: (30, 51, 51, 51, 62, 48, 48, 24, 14, 0, 0),  # '9'
+    58: (0, 0, 12, 12, 0, 0, 12, 12, 0, 0, 0),  # ':'
+    59: (0, 0, 12, 12, 0, 0, 12, 12, 6, 0, 0),  # ';'
+    60: (0, 0, 24, 12, 6, 3, 6, 12, 24, 0, 0),  # '<'
+    61: (0, 0, 0, 63, 0, 0, 63, 0, 0, 0, 0),  # '='
+    62: (0, 0, 3, 6, 12, 24, 12, 6, 3, 0, 0),  # '>'
+    63: (30, 51, 51, 24, 12, 12, 0, 12, 12, 0, 0),  # '?'
+    64: (30, 51, 51, 59, 59, 59, 27, 3, 30, 0, 0),  # '@'
+    65: (12, 30, 51, 51, 63, 51, 51, 51, 51, 0, 0),  # 'A'
+    66: (31, 51, 51, 51, 31, 51, 51, 51, 31, 0, 0),  # 'B'
+    67: (28, 54, 35, 3, 3, 3, 35, 54, 28, 0, 0),  # 'C'
+    68: (15, 27, 51, 51, 51, 51, 51, 27, 15, 0, 0),  # 'D'
+    69: (63, 51, 35, 11, 15, 11, 35, 51, 63, 0, 0),  # 'E'
+    70: (63, 51, 35, 11, 15, 11, 3, 3, 3, 0, 0),  # 'F'
+    71: (28, 54, 35, 3, 59, 51, 51, 54, 44, 0, 0),  # 'G'
+    72: (51, 51, 51, 51, 63, 51, 51, 51, 51, 0, 0),  # 'H'
+    73: (30, 12, 12, 12, 12, 12, 12, 12, 30, 0, 0),  # 'I'
+    74: (60, 24, 24, 24, 24, 24, 27, 27, 14, 0, 0),  # 'J'
+    75: (51, 51, 51, 27, 15, 27, 51, 51, 51, 0, 0),  # 'K'
+    76: (3, 3, 3, 3, 3, 3, 35, 51, 63, 0, 0),  # 'L'
+    77: (33, 51, 63, 63, 51, 51, 51, 51, 51, 0, 0),  # 'M'
+    78: (51, 51, 55, 55, 63, 59, 59, 51, 51, 0, 0),  # 'N'
+    79: (30, 51, 51, 51, 51, 51, 51, 51, 30, 0, 0),  # 'O'
+    80: (31, 51, 51, 51, 31, 3, 3, 3, 3, 0, 0),  # 'P'
+    81: (30, 51, 51, 51, 51, 51, 63, 59, 30, 48, 0),  # 'Q'
+    82: (31, 51, 51, 51, 31, 27, 51, 51, 51, 0, 0),  # 'R'
+    83: (30, 51, 51, 6, 28, 48, 51, 51, 30, 0, 0),  # 'S'
+    84: (63, 63, 45, 12, 12, 12, 12, 12, 30, 0, 0),  # 'T'
+    85: (51, 51, 51, 51, 51, 51, 51, 51, 30, 0, 0),  # 'U'
+    86: (51, 51, 51, 51, 51, 30, 30, 12, 12, 0, 0),  # 'V'
+    87: (51, 51, 51, 51, 51, 63, 63, 63, 18, 0, 0),  # 'W'
+    88: (51, 51, 30, 30, 12, 30, 30, 51, 51, 0, 0),  # 'X'
+    89: (51, 51, 51, 51, 30, 12, 12, 12, 30, 0, 0),  # 'Y'
+    90: (63, 51, 49, 24, 12, 6, 35, 51, 63, 0, 0),  # 'Z'
+    91: (30, 6, 6, 6, 6, 6, 6, 6, 30, 0, 0),  # '['
+    92: (0, 0, 1, 3, 6, 12, 24, 48, 32, 0, 0),  # '\\'
+    93: (30, 24, 24, 24, 24, 24, 24, 24, 30, 0, 0),  # ']'
+    94: (8, 28, 54, 0, 0, 0, 0, 0, 0, 0, 0),  # '^'
+    95: (0, 0, 0, 0, 0, 0, 0, 0, 0, 63, 0),  # '_'
+    96: (6, 12, 24, 0, 0, 0, 0, 0, 0, 0, 0),  # '`'
+    97: (0, 0, 0, 14, 24, 30, 27, 27, 54, 0, 0),  # 'a'
+    98: (3, 3, 3, 15, 27, 51, 51, 51, 30, 0, 0),  # 'b'
+    99: (0, 0, 0, 30, 51, 3, 3, 51, 30, 0, 0),  # 'c'
+    100: (48, 48, 48, 60, 54, 51, 51, 51, 30, 0, 0),  # 'd'
+    101: (0, 0, 0, 30, 51, 63, 3, 51, 30, 0, 0),  # 'e'
+    102: (28, 54, 38, 6, 15, 6, 6, 6, 15, 0, 0),  # 'f'
+    103: (0, 0, 30, 51, 51, 51, 62, 48, 51, 30, 0),  # 'g'
+    104: (3, 3, 3, 27, 55, 51, 51, 51, 51, 0, 0),  # 'h'
+    105: (12, 12, 0, 14, 12, 12, 12, 12, 30, 0, 0),  # 'i'
+    106: (48, 48, 0, 56, 48, 48, 48, 48, 51, 30, 0),  # 'j'
+    107: (3, 3, 3, 51, 27, 15, 15, 27, 51, 0, 0),  # 'k'
+    108: (14, 12, 12, 12, 12, 12, 12, 12, 30, 0, 0),  # 'l'
+    109: (0, 0, 0, 29, 63, 43, 43, 43, 43, 0, 0),  # 'm'
+    110: (0, 0, 0, 29, 51, 51, 51, 51, 51, 0, 0),  # 'n'
+    111: (0, 0, 0, 30, 51, 51, 51, 51, 30, 0, 0),  # 'o'
+    112: (0, 0, 0, 30, 51, 51, 51, 31, 3, 3, 0),  # 'p'
+    113: (0, 0, 0, 30, 51, 51, 51, 62, 48, 48, 0),  # 'q'
+    114: (0, 0, 0, 29, 55, 51, 3, 3, 7, 0, 0),  # 'r'
+    115: (0, 0, 0, 30, 51, 6, 24, 51, 30, 0, 0),  # 's'
+    116: (4, 6, 6, 15, 6, 6, 6, 54, 28, 0, 0),  # 't'
+    117: (0, 0, 0, 27, 27, 27, 27, 27, 54, 0, 0),  # 'u'
+    118: (0, 0, 0, 51, 51, 51, 51, 30, 12, 0, 0),  # 'v'
+    119: (0, 0, 0, 51, 51, 51, 63, 63, 18, 0, 0),  # 'w'
+    120: (0, 0, 0, 51, 30, 12, 12, 30, 51, 0, 0),  # 'x'
+    121: (0, 0, 0, 51, 51, 51, 62, 48, 24, 15, 0),  # 'y'
+    122: (0, 0, 0, 63, 27, 12, 6, 51, 63, 0, 0),  # 'z'
+    123: (56, 12, 12, 12, 7, 12, 12, 12, 56, 0, 0),  # '{'
+    124: (12, 12, 12, 12, 12, 12, 12, 12, 12, 0, 0),  # '|'
+    125: (7, 12, 12, 12, 56, 12, 12, 12, 7, 0, 0),  # '}'
+    126: (38, 45, 25, 0, 0, 0, 0, 0, 0, 0, 0),  # '~'
+}
+
+class VMError(Exception):
+    pass
+
+class Halt(Exception):
+    """Raised by the native Sys.halt."""
+
+class NativeOS:
+    """Python versions of Jack OS functions, working directly on the VM's RAM.
+
+    They follow the book's algorithms, so RAM ends up as a Jack OS written
+    from the book would leave it. The heap is a first-fit free list over
+    2048..16383, and each block's size sits in the word before it. A String
+    is [maxLength, length, chars...]. Lines and circles are drawn pixel for
+    pixel as in the book. Output draws the book's font into screen memory
+    and keeps a copy of the text for headless runs. Keyboard reads its keys
+    from a script: keyPressed returns RAM[KBD], and once the script runs out
+    readChar returns 0 and readLine ends the line. Errors raise VMError with
+    the OS error code.
+
+    Some natives share hidden state (the heap, the String layout, the pen
+    color). GROUPS lists those, and a program must use all or none of each
+    group natively.
+    """
+    HEAP_BASE, HEAP_END = 2048, SCREEN
+    GROUPS = [
+        ("Memory.init", "Memory.alloc", "Memory.deAlloc", "Array.new", "Array.dispose",
+         "String.new", "String.dispose", "String.length", "String.charAt", "String.setCharAt",
+         "String.appendChar", "String.eraseLastChar", "String.intValue", "String.setInt"),
+        ("Screen.init", "Screen.setColor", "Screen.drawPixel", "Screen.drawLine",
+         "Screen.drawRectangle", "Screen.drawCircle"),
+        # The cursor; readChar/readLine/readInt echo through it.
+        ("Output.init", "Output.moveCursor", "Output.printChar", "Output.printString",
+         "Output.printInt", "Output.println", "Output.backSpace",
+         "Keyboard.readChar", "Keyboard.readLine", "Keyboard.readInt"),
+        # Strings read or built natively.
+        ("String.new", "String.appendChar", "String.length", "String.charAt",
+         "Output.printString", "Keyboard.readLine", "Keyboard.readInt"),
+    ]
+
+    def __init__(self, ram, keys=()):
+        self.ram = ram
+        self.free = [[self.HEAP_BASE, self.HEAP_END - self.HEAP_BASE]]  # [address, size], sorted
+        self.color = True
+        self.row = self.column = 0
+        self.text = [[" "] * TEXT_COLUMNS for _ in range(TEXT_ROWS)]
+        self.keys = deque(keys)  # key codes still to be typed
+        self.functions = {
+            "Math.init": lambda: 0, "Math.multiply": self.multiply, "Math.divide": self.divide,
+            "Math.sqrt": self.sqrt, "Math.max": max, "Math.min": min, "Math.abs": self.abs,
+            "Memory.init": self.memory_init, "Memory.peek": self.peek, "Memory.poke": self.poke,
+            "Memory.alloc": self.alloc, "Memory.deAlloc": self.dealloc,
+            "Array.new": self.array_new, "Array.dispose": self.dealloc,
+            "String.new": self.string_new, "String.dispose": self.dealloc,
+            "String.length": lambda s: self.ram[s + 1], "String.charAt": self.char_at,
+            "String.setCharAt": self.set_char_at, "String.appendChar": self.append_char,
+            "String.eraseLastChar": self.erase_last_char, "String.intValue": self.int_value,
+            "String.setInt": self.set_int, "String.newLine": lambda: 128,
+            "String.backSpace": lambda: 129, "String.doubleQuote": lambda: 34,
+            "Screen.init": self.screen_init, "Screen.clearScreen": self.clear_screen,
+            "Screen.setColor": self.set_color, "Screen.drawPixel": self.draw_pixel,
+            "Screen.drawLine": self.draw_line, "Screen.drawRectangle": self.draw_rectangle,
+            "Screen.drawCircle": self.draw_circle,
+            "Output.init": self.output_init, "Output.moveCursor": self.move_cursor,
+            "Output.printChar": self.print_char, "Output.printString": self.print_string,
+            "Output.printInt": self.print_int, "Output.println": self.println,
+            "Output.backSpace": self.back_space,
+            "Keyboard.init": lambda: 0, "Keyboard.keyPressed": lambda: self.ram[KBD],
+            "Keyboard.readChar": self.read_char, "Keyboard.readLine": self.read_line,
+            "Keyboard.readInt": self.read_int,
+            "Sys.wait": lambda duration: 0, "Sys.halt": self.halt, "Sys.error": self.error,
+        }
+
+    @staticmethod
+    def error(code):
+        raise VMError(f"Sys.error({code})")
+
+    @staticmethod
+    def halt():
+        raise Halt()
+
+    # Math
+    @staticmethod
+    def multiply(x, y):
+        return _word(x * y)
+
+    def divide(self, x, y):
+        if y == 0:
+            self.error(3)
+        q = abs(x) // abs(y)
+        return _word(-q if (x < 0) != (y < 0) else q)
+
+    def sqrt(self, x):
+        if x < 0:
+            self.error(4)
+        return math.isqrt(x)
+
+    @staticmethod
+    def abs(x):
+        return _word(-x) if x < 0 else x
+
+    # Memory
+    def memory_init(self):
+        self.free = [[self.HEAP_BASE, self.HEAP_END - self.HEAP_BASE]]
+
+    def peek(self, address):
+        return self.ram[self._address(address)]
+
+    def poke(self, address, value):
+        self.ram[self._address(address)] = value
+
+    @staticmethod
+    def _address(address):
+        if address < 0:  # Python would index from the end of RAM
+            raise VMError(f"negative RAM address {address}")
+        return address
+
+    def alloc(self, size):
+        if size <= 0:
+            self.error(5)
+        for segment in self.free:
+            if segment[1] >= size + 1:
+                block = segment[0] + 1
+                self.ram[segment[0]] = size + 1
+                segment[0] += size + 1
+                segment[1] -= size + 1
+                if not segment[1]:
+                    self.free.remove(segment)
+                return block
+        self.error(6)
+
+    def array_new(self, size):
+        if size <= 0:
+            self.error(2)
+        return self.alloc(size)
+
+    def dealloc(self, block):
+        start, size = block - 1, self.ram[block - 1]
+        free = self.free
+        i = 0
+        while i < len(free) and free[i][0] < start:
+            i += 1
+        free.insert(i, [start, size])
+        if i + 1 < len(free) and start + size == free[i + 1][0]:
+            free[i][1] += free.pop(i + 1)[1]
+        if i > 0 and free[i - 1][0] + free[i - 1][1] == start:
+            free[i - 1][1] += free.pop(i)[1]
+
+    # String: [maxLength, length, chars...]
+    def string_new(self, max_length):
+        if max_length < 0:
+            self.error(14)
+        s = self.alloc(max_length + 2)
+        self.ram[s], self.ram[s + 1] = max_length, 0
+        return s
+
+    def char_at(self, s, j):
+        if not 0 <= j < self.ram[s + 1]:
+            self.error(15)
+        return self.ram[s + 2 + j]
+
+    def set_char_at(self, s, j, c):
+        if not 0 <= j < self.ram[s + 1]:
+            self.error(16)
+        self.ram[s + 2 + j] = c
+
+    def append_char(self, s, c):
+        length = self.ram[s + 1]
+        if length >= self.ram[s]:
+            self.error(17)
+        self.ram[s + 2 + length] = c
+        self.ram[s + 1] = length + 1
+        return s
+
+    def erase_last_char(self, s):
+        if self.ram[s + 1] <= 0:
+            self.error(18)
+        self.ram[s + 1] -= 1
+
+    def int_value(self, s):
+        value, sign = 0, 1
+        for j in range(self.ram[s + 1]):
+            c = self.ram[s + 2 + j]
+            if j == 0 and c == 45:  # '-'
+                sign = -1
+            elif 48 <= c <= 57:
+                value = _word(value * 10 + c - 48)
+            else:
+                break
+        return _word(sign * value)
+
+    def set_int(self, s, value):
+        digits = str(value)
+        if len(digits) > self.ram[s]:
+            self.error(19)
+        for j, c in enumerate(digits):
+            self.ram[s + 2 + j] = ord(c)
+        self.ram[s + 1] = len(digits)
+
+    # Screen
+    def screen_init(self):
+        self.color = True
+
+    def clear_screen(self):
+        self.ram[SCREEN:KBD] = array('h', bytes(2 * (KBD - SCREEN)))
+
+    def set_color(self, color):
+        self.color = bool(color)
+
+    def _pixel(self, x, y):
+        address = SCREEN + y * 32 + (x >> 4)
+        word = self.ram[address] & 0xFFFF
+        word = word | (1 << (x & 15)) if self.color else word & ~(1 << (x & 15))
+        self.ram[address] = _word(word)
+
+    def draw_pixel(self, x, y):
+        if not (0 <= x < 512 and 0 <= y < 256):
+            self.error(7)
+        self._pixel(x, y)
+
+    def draw_line(self, x1, y1, x2, y2):
+        if not (0 <= x1 < 512 and 0 <= x2 < 512 and 0 <= y1 < 256 and 0 <= y2 < 256):
+            self.error(8)
+        dx, dy = x2 - x1, y2 - y1
+        sx, sy = (1 if dx >= 0 else -1), (1 if dy >= 0 else -1)
+        dx, dy = abs(dx), abs(dy)
+        if dy == 0:
+            for x in range(min(x1, x2), max(x1, x2) + 1):
+                self._pixel(x, y1)
+            return
+        if dx == 0:
+            for y in range(min(y1, y2), max(y1, y2) + 1):
+                self._pixel(x1, y)
+            return
+        a = b = diff = 0  # diff = a*dy - b*dx
+        while a <= dx and b <= dy:
+            self._pixel(x1 + a * sx, y1 + b * sy)
+            if diff < 0:
+                a += 1
+                diff += dy
+            else:
+                b += 1
+                diff -= dx
+
+    def draw_rectangle(self, x1, y1, x2, y2):
+        if not (0 <= x1 <= x2 < 512 and 0 <= y1 <= y2 < 256):
+            self.error(9)
+        for y in range(y1, y2 + 1):
+            for x in range(x1, x2 + 1):
+                self._pixel(x, y)
+
+    def draw_circle(self, x, y, r):
+        if not (0 <= x < 512 and 0 <= y < 256):
+            self.error(12)
+        if not 0 <= r <= 181:
+            self.error(13)
+        for dy in range(-r, r + 1):
+            h = math.isqrt(r * r - dy * dy)
+            if 0 <= y + dy < 256:
+                for px in range(max(x - h, 0), min(x + h, 511) + 1):
+                    self._pixel(px, y + dy)
+
+    # Output: 23 rows of 64 characters, each 11 x 8 pixels
+    def output_init(self):
+        self.row = self.column = 0
+        self.text = [[" "] * TEXT_COLUMNS for _ in range(TEXT_ROWS)]
+
+    def move_cursor(self, i, j):
+        if not (0 <= i < TEXT_ROWS and 0 <= j < TEXT_COLUMNS):
+            self.error(20)
+        self.row, self.column = i, j
+
+    def _draw_char(self, c):
+        """Draws c at the cursor without moving it."""
+        column = self.column
+        address = SCREEN + self.row * 11 * 32 + (column >> 1)
+        for bits in FONT.get(c, FONT[0]):
+            word = self.ram[address] & 0xFFFF
+            word = (word & 0x00FF) | (bits << 8) if column & 1 else (word & 0xFF00) | bits
+            self.ram[address] = _word(word)
+            address += 32
+        self.text[self.row][column] = chr(c) if c in FONT and c else "#"
+
+    def print_char(self, c):
+        if c == NEW_LINE:
+            self.println()
+        elif c == BACKSPACE:
+            self.back_space()
+        else:
+            self._draw_char(c)
+            self.column += 1
+            if self.column == TEXT_COLUMNS:
+                self.println()
+
+    def print_string(self, s):
+        for j in range(self.ram[s + 1]):
+            self.print_char(self.ram[s + 2 + j])
+
+    def print_int(self, i):
+        for c in str(i):
+            self.print_char(ord(c))
+
+    def println(self):
+        self.column = 0
+        self.row = (self.row + 1) % TEXT_ROWS
+
+    def back_space(self):
+        if self.column:
+            self.column -= 1
+        elif self.row:
+            self.row, self.column = self.row - 1, TEXT_COLUMNS - 1
+        self._draw_char(32)
+
+    def output_text(self):
+        """What Output printed, one line per text row, or None if nothing was."""
+        text = "\n".join("".join(row).rstrip() for row in self.text).rstrip()
+        return text or None
+
+    # Keyboard
+    def read_char(self):
+        c = self.keys.popleft() if self.keys else 0
+        if c:
+            self.print_char(c)
+        return c
+
+    def read_line(self, message):
+        self.print_string(message)
+        chars = []
+        while True:
+            c = self.keys.popleft() if self.keys else NEW_LINE
+            if c == NEW_LINE:
+                self.println()
+                break
+            if c == BACKSPACE:
+                if chars:
+                    chars.pop()
+                    self.back_space()
+                continue
+            chars.append(c)
+            self.print_char(c)
+        s = self.string_new(len(chars))
+        for c in chars:
+            self.append_char(s, c)
+        return s
+
+    def read_int(self, message):
+        s = self.read_line(message)
+        value = self.int_value(s)
+        self.dealloc(s)
+        return value
+
+def select_natives(program, native=(), jack=()):
+    """Decides which functions run natively.
+
+    By default a function runs natively when the program does not define it,
+    as with the OS built into the course's VM emulator. `native` and `jack`
+    name functions or whole classes ("Math") to force one way or the other.
+    """
+    def named(name, specs):
+        return name in specs or name.split(".")[0] in specs or "all" in specs
+
+    chosen = set()
+    for name in NativeOS(None).functions:
+        if named(name, jack):
+            continue
+        function_id = program.ids.get(name)
+        if named(name, native) or function_id is None or program.entry[function_id] < 0:
+            chosen.add(name)
+    for group in NativeOS.GROUPS:
+        group = [name for name in group if name in program.ids]  # the ones the program mentions
+        used = [name for name in group if name in chosen]
+        if used and len(used) < len(group):
+            missing = [name for name in group if name not in chosen]
+            raise VMError(f"{', '.join(used)} share state with {', '.join(missing)}: "
+                          f"run all of them natively or none")
+    return chosen
+
+class Program:
+    """VM files decoded into three flat int arrays: opcode, a, b.
+
+    Jump targets are code indices and calls are function ids (an index into
+    self.names / self.entry), so running a command never looks up a string.
+    Statics get RAM addresses from 16 up, file by file, like the VM emulator.
+    """
+    def __init__(self, vm_files):
+        self.code, self.a, self.b = array('i'), array('i'), array('i')
+        self.names = []      # function id -> name
+        self.ids = {}        # name -> function id
+        self.entry = array('i')  # function id -> code index, -1 if not defined
+        self.source = []     # code index -> VM text, for error messages
+        self.function_at = array('i')  # code index -> id of the function it is in, -1 before any
+        next_static = STATIC_BASE
+        labels, jumps = {}, []
+        for vf in vm_files:
+            statics = {}
+            function = ""
+            self.current_id = -1
+            for cmd in translator.Parser(vf).commands:
+                op = cmd.op
+                if op == Op.C_LABEL:
+                    labels[f"{function}${cmd.arg1}"] = len(self.code)
+                    continue
+                if op == Op.C_ARITHMETIC:
+                    self._emit(ARITHMETIC[cmd.arg1], 0, 0, cmd.arg1)
+                elif op in (Op.C_PUSH, Op.C_POP):
+                    text = f"{'push' if op == Op.C_PUSH else 'pop'} {cmd.arg1} {cmd.arg2}"
+                    segment, index = cmd.arg1, cmd.arg2
+                    if segment == "constant":
+                        self._emit(PUSH_CONST, index, 0, text)
+                        continue
+                    if segment in SEG_POINTERS:
+                        self._emit(PUSH_IND if op == Op.C_PUSH else POP_IND, SEG_POINTERS[segment], index, text)
+                        continue
+                    if segment == "static":
+                        if index not in statics:
+                            statics[index] = next_static
+                            next_static += 1
+                        address = statics[index]
+                    else:
+                        address = (5 if segment == "temp" else 3) + index
+                    self._emit(PUSH_DIR if op == Op.C_PUSH else POP_DIR, address, 0, text)
+                elif op in (Op.C_GOTO, Op.C_IF):
+                    jumps.append((len(self.code), f"{function}${cmd.arg1}"))
+                    self._emit(GOTO if op == Op.C_GOTO else IF_GOTO, -1, 0,
+                               f"{'goto' if op == Op.C_GOTO else 'if-goto'} {cmd.arg1}")
+                elif op == Op.C_FUNCTION:
+                    function = cmd.arg1
+                    self.current_id = self._function_id(function)
+                    self.entry[self.current_id] = len(self.code)
+                    self._emit(FUNCTION, cmd.arg2, 0, f"function {function} {cmd.arg2}")
+                elif op == Op.C_CALL:
+                    self._emit(CALL, self._function_id(cmd.arg1), cmd.arg2, f"call {cmd.arg1} {cmd.arg2}")
+                elif op == Op.C_RETURN:
+                    self._emit(RETURN, 0, 0, "return")
+        self.static_end = next_static
+        for i, label in jumps:
+            if label not in labels:
+                raise VMError(f"{self.source[i]}: no such label in {label.split('$')[0] or 'the file'}")
+            self.a[i] = labels[label]
+        for i, _ in jumps:
+            if self.code[i] == GOTO and self.a[i] <= i and self._never_leaves(self.a[i], i):
+                # `label L; goto L` or Jack's `while (true) {}`: how Sys.halt and tests stop.
+                self.code[i] = HALT
+
+    def _never_leaves(self, start, goto):
+        """True if the loop start..goto only computes constants and none of its exits is taken."""
+        stack = []
+        for i in range(start, goto):
+            op = self.code[i]
+            if op == PUSH_CONST:
+                stack.append(self.a[i])
+            elif op in (NEG, NOT) and stack:
+                stack.append(-stack.pop() if op == NEG else ~stack.pop())
+            elif op == IF_GOTO and stack:
+                if stack.pop():
+                    return False
+            else:
+                return False
+        return not stack
+
+    def _emit(self, opcode, a, b, text):
+        self.function_at.append(self.current_id)
+        self.code.append(opcode)
+        self.a.append(a)
+        self.b.append(b)
+        self.source.append(text)
+
+    def _function_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.entry.append(-1)
+        return self.ids[name]
+
+class VM:
+    """Runs a Program on a flat array('h') RAM, with the pointers at RAM[0..4]."""
+    def __init__(self, program, natives=(), keys=()):
+        self.program = program
+        self.ram = array('h', bytes(2 * RAM_SIZE))
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+        # Function id -> Python function, for the natives in use.
+        self.os = NativeOS(self.ram, keys)
+        self.natives = [self.os.functions[name] if name in natives else None for name in program.names]
+        self.native_calls = {}
+        self.profiler = None
+
+    def boot(self):
+        """Starts at Sys.init with the stack the bootstrap code would leave, or at the first command.
+
+        A stack pointer that was already set is kept, with LCL and ARG.
+        """
+        sys_init = self.program.ids.get("Sys.init")
+        has_init = sys_init is not None and self.program.entry[sys_init] >= 0
+        self.pc = self.program.entry[sys_init] if has_init else 0
+        if not self.ram[0]:
+            self.ram[0] = 261 if has_init else 256
+            if has_init:
+                # call Sys.init 0 from SP=256: LCL past the saved frame, ARG at its base.
+                self.ram[1], self.ram[2] = 261, 256
+        main = self.program.ids.get("Main.main")
+        if not has_init and main is not None and self.program.entry[main] >= 0 and any(self.natives):
+            # The native OS has no Sys.init: run Main.main and return past the end of the code.
+            sp = self.ram[0]
+            self.ram[sp:sp + 5] = array('h', [len(self.program.code), 0, 0, 0, 0])
+            self.ram[2], self.ram[1] = sp, sp + 5
+            self.ram[0] = sp + 5
+            self.pc = self.program.entry[main]
+
+    def run(self, max_steps):
+        """Executes up to max_steps commands; stops early at a halt loop or the end of the code."""
+        try:
+            return self._run(max_steps)
+        except VMError as e:
+            raise VMError(f"{self.program.source[self.pc]}: {e}") from None
+        except (IndexError, OverflowError):
+            raise VMError(f"{self.program.source[self.pc]}: RAM address or value out of range "
+                          f"(stack overflow?)") from None
+
+    def _run(self, max_steps):
+        program = self.program
+        code, A, B, entry = program.code, program.a, program.b, program.entry
+        ram, natives, calls = self.ram, self.natives, self.native_calls
+        profiler = self.profiler
+        pc, end = self.pc, len(code)
+        steps = 0
+        try:
+            while steps < max_steps:
+                if pc >= end:
+                    self.halted = True
+                    break
+                op = code[pc]
+                steps += 1
+                if op == PUSH_IND:
+                    address = ram[A[pc]] + B[pc]
+                    if address < 0:  # Python would index from the end of RAM
+                        raise VMError(f"negative RAM address {address}")
+                    sp = ram[0]
+                    ram[sp] = ram[address]
+                    ram[0] = sp + 1
+                elif op == PUSH_CONST:
+                    sp = ram[0]
+                    ram[sp] = A[pc]
+                    ram[0] = sp + 1
+                elif op == POP_IND:
+                    address = ram[A[pc]] + B[pc]
+                    if address < 0:
+                        raise VMError(f"negative RAM address {address}")
+                    sp = ram[0] - 1
+                    ram[address] = ram[sp]
+                    ram[0] = sp
+                elif op == PUSH_DIR:
+                    sp = ram[0]
+                    ram[sp] = ram[A[pc]]
+                    ram[0] = sp + 1
+                elif op == POP_DIR:
+                    sp = ram[0] - 1
+                    ram[A[pc]] = ram[sp]
+                    ram[0] = sp
+                elif op <= OR:
+                    sp = ram[0] - 1
+                    y = ram[sp]
+                    if op == NEG:
+                        ram[sp] = -y if y != -32768 else y
+                        pc += 1
+                        continue
+                    x = ram[sp - 1]
+                    if op == ADD:
+                        x = ((x + y + 32768) & 0xFFFF) - 32768
+                    elif op == SUB:
+                        x = ((x - y + 32768) & 0xFFFF) - 32768
+                    elif op == AND:
+                        x &= y
+                    elif op == OR:
+                        x |= y
+                    else:
+                        # Like the Hack code: the sign of x - y, wrapped to 16 bits.
+                        d = ((x - y + 32768) & 0xFFFF) - 32768
+                        x = -1 if (d == 0 if op == EQ else d > 0 if op == GT else d < 0) else 0
+                    ram[sp - 1] = x
+                    ram[0] = sp
+                elif op == NOT:
+                    sp = ram[0] - 1
+                    ram[sp] = ~ram[sp]
+                elif op == IF_GOTO:
+                    sp = ram[0] - 1
+                    ram[0] = sp
+                    if ram[sp]:
+                        pc = A[pc]
+                        continue
+                elif op == GOTO:
+                    pc = A[pc]
+                    continue
+                elif op == CALL:
+                    native = natives[A[pc]]
+                    if native is not None:
+                        sp = ram[0] - B[pc]
+                        result = native(*ram[sp:sp + B[pc]])
+                        ram[sp] = result or 0
+                        ram[0] = sp + 1
+                        calls[A[pc]] = calls.get(A[pc], 0) + 1
+                        if profiler is not None:
+                            profiler.native(A[pc], self.steps + steps)
+                        pc += 1
+                        continue
+                    target = entry[A[pc]]
+                    if target < 0:
+                        self.pc = pc
+                        raise VMError("function not defined")
+                    sp = ram[0]
+                    ram[sp] = pc + 1
+                    ram[sp + 1] = ram[1]
+                    ram[sp + 2] = ram[2]
+                    ram[sp + 3] = ram[3]
+                    ram[sp + 4] = ram[4]
+                    ram[2] = sp - B[pc]
+                    ram[1] = ram[0] = sp + 5
+                    if profiler is not None:
+                        profiler.enter(A[pc], self.steps + steps, sp + 5)
+                    pc = target
+                    continue
+                elif op == FUNCTION:
+                    sp = ram[0]
+                    for i in range(A[pc]):
+                        ram[sp + i] = 0
+                    ram[0] = sp + A[pc]
+                elif op == RETURN:
+                    frame = ram[1]
+                    ret = ram[frame - 5]
+                    arg = ram[2]
+                    ram[arg] = ram[ram[0] - 1]
+                    ram[0] = arg + 1
+                    ram[4] = ram[frame - 1]
+                    ram[3] = ram[frame - 2]
+                    ram[2] = ram[frame - 3]
+                    ram[1] = ram[frame - 4]
+                    if profiler is not None:
+                        profiler.leave(self.steps + steps)
+                    pc = ret
+                    continue
+                elif op == HALT:
+                    self.halted = True
+                    break
+                pc += 1
+        except Halt:
+            self.halted = True
+        except (IndexError, OverflowError, VMError):
+            self.pc = pc
+            raise
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+    def profile(self):
+        """Attaches a Profiler; call before run()."""
+        function_id = self.program.function_at[self.pc] if self.pc < len(self.program.code) else -1
+        self.profiler = Profiler(self.program, function_id, self.steps)
+        return self.profiler
+
+    def screen_text(self):
+        """The screen at 4x8 pixels per character, or None if nothing was drawn."""
+        ram = self.ram
+        if not any(ram[SCREEN:KBD]):
+            return None
+        rows = []
+        for y in range(0, 256, 8):
+            row = []
+            for word in range(32):
+                bits = 0
+                for dy in range(8):
+                    bits |= ram[SCREEN + (y + dy) * 32 + word]
+                row.extend("#" if bits & (0xF << shift) else " " for shift in range(0, 16, 4))
+            rows.append("".join(row).rstrip())
+        return "\n".join(rows)
+
+class Profiler:
+    """Attributes executed VM commands to functions through call and return.
+
+    Keeps a tree of call paths. Each node counts the commands run while its
+    path was the whole call stack, so exclusive, inclusive and per-path
+    (folded stack) numbers all come from the same counts. A command belongs
+    to the function it is in: `call` to the caller, `function` and `return`
+    to the callee. A native call is one command of its own node.
+    """
+    def __init__(self, program, root, steps):
+        self.program = program
+        self.parent, self.function, self.children, self.ops = [-1], [root], [{}], [0]
+        self.stack = [0]
+        self.last = steps  # step count at the last call/return
+        self.calls = {}
+        self.max_depth = {root: 1}
+        self.peak_sp = 0
+
+    def _node(self, function_id):
+        top = self.stack[-1]
+        node = self.children[top].get(function_id)
+        if node is None:
+            node = self.children[top][function_id] = len(self.parent)
+            self.parent.append(top)
+            self.function.append(function_id)
+            self.children.append({})
+            self.ops.append(0)
+        return node
+
+    def _account(self, steps):
+        self.ops[self.stack[-1]] += steps - self.last
+        self.last = steps
+
+    def enter(self, function_id, steps, sp):
+        self._account(steps)
+        self.stack.append(self._node(function_id))
+        self.calls[function_id] = self.calls.get(function_id, 0) + 1
+        depth = len(self.stack)
+        if depth > self.max_depth.get(function_id, 0):
+            self.max_depth[function_id] = depth
+        if sp > self.peak_sp:
+            self.peak_sp = sp
+
+    def leave(self, steps):
+        self._account(steps)
+        if len(self.stack) > 1:  # returning from the function we started in ends nowhere
+            self.stack.pop()
+
+    def native(self, function_id, steps):
+        self._account(steps - 1)  # the call itself is the native's one command
+        self.enter(function_id, steps - 1, 0)
+        self.leave(steps)
+
+    def finish(self, steps):
+        self._account(steps)
+
+    def _name(self, function_id):
+        return self.program.names[function_id] if function_id >= 0 else "(top level)"
+
+    def _path(self, node):
+        path = []
+        while node >= 0:
+            path.append(self._name(self.function[node]))
+            node = self.parent[node]
+        return path[::-1]
+
+    def folded(self):
+        """Flamegraph input: 'Sys.init;Main.main;Math.multiply <commands>' per call path."""
+        return [f"{';'.join(self._path(node))} {ops}" for node, ops in enumerate(self.ops) if ops]
+
+    def report(self, top=30):
+        exclusive, inclusive = {}, {}
+        for node, ops in enumerate(self.ops):
+            function_id = self.function[node]
+            exclusive[function_id] = exclusive.get(function_id, 0) + ops
+            seen, walk = set(), node
+            while walk >= 0:  # recursion counts once per path
+                seen.add(self.function[walk])
+                walk = self.parent[walk]
+            for f in seen:
+                inclusive[f] = inclusive.get(f, 0) + ops
+        total = sum(self.ops) or 1
+        lines = [f"{'function':<32} {'calls':>9} {'self ops':>11} {'self %':>7} {'total ops':>11} "
+                 f"{'total %':>7} {'depth':>5}"]
+        for f in sorted(inclusive, key=lambda f: (-inclusive[f], self._name(f)))[:top]:
+            lines.append(f"{self._name(f):<32} {self.calls.get(f, 0):>9} {exclusive.get(f, 0):>11} "
+                         f"{exclusive.get(f, 0) / total:>7.1%} {inclusive[f]:>11} "
+                         f"{inclusive[f] / total:>7.1%} {self.max_depth.get(f, 0):>5}")
+        lines.append(f"max call depth {max(self.max_depth.values())}, peak SP {self.peak_sp}")
+        return "\n".join(lines)
+
+def vm_files_in(path):
+    path = path.rstrip('/')
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.vm'))
+    return [path]
+
+def ram_address(vm, name):
+    """sp / local / ... / RAM[n] / local[i] as used by the course's .tst scripts."""
+    m = re.fullmatch(r"(\w+)(?:\[(\d+)\])?", name)
+    if not m:
+        raise VMError(f"cannot address {name}")
+    base, index = m.group(1), m.group(2)
+    if base == "RAM":
+        return int(index)
+    if base in TST_POINTERS:
+        return TST_POINTERS[base] if index is None else vm.ram[TST_POINTERS[base]] + int(index)
+    raise VMError(f"cannot address {name}")
+
+def run_test(tst_path, max_steps=None, native=(), jack=(), out_dir=None):
+    """Runs a VM emulator .tst script (load/set/repeat vmstep/output-list/output).
+
+    Returns True when the output matches the .cmp file, compared in memory.
+    The .out file is only written when out_dir is given, never into the
+    source tree.
+    """
+    directory = os.path.dirname(os.path.abspath(tst_path))
+    with open(tst_path, 'r') as f:
+        script = re.sub(r"//[^\n]*|/\*.*?\*/", "", f.read(), flags=re.S)
+    vm, columns, out_lines, cmp_file, out_file = None, [], [], None, None
+    for statement in re.findall(r"repeat\s+\d+\s*\{[^}]*\}|[^,;{}]+", script):
+        words = statement.split()
+        if not words:
+            continue
+        if words[0] == "load":
+            target = os.path.join(directory, words[1]) if len(words) > 1 else directory
+            program = Program(vm_files_in(target))
+            vm = VM(program, select_natives(program, native, jack))
+            vm.boot()
+        elif words[0] == "output-file":
+            out_file = words[1]
+        elif words[0] == "compare-to":
+            cmp_file = os.path.join(directory, words[1])
+        elif words[0] == "set":
+            vm.ram[ram_address(vm, words[1])] = int(words[2])
+        elif words[0] == "repeat":
+            count = int(words[1])
+            vm.run(count if max_steps is None else min(count, max_steps))
+        elif words[0] == "output-list":
+            columns = [re.fullmatch(r"(.+)%D(\d+)\.(\d+)\.(\d+)", w).groups() for w in words[1:]]
+            out_lines.append("|" + "|".join(name.center(int(l) + int(w) + int(r))[:int(l) + int(w) + int(r)]
+                                            for name, l, w, r in columns) + "|")
+        elif words[0] == "output":
+            out_lines.append("|" + "|".join(" " * int(l) + str(vm.ram[ram_address(vm, name)]).rjust(int(w))
+                                            + " " * int(r) for name, l, w, r in columns) + "|")
+    if out_file and out_dir:
+        with open(os.path.join(out_dir, out_file), 'w') as f:
+            f.write("\n".join(out_lines) + "\n")
+    if not cmp_file:
+        return True
+    with open(cmp_file, 'r') as f:
+        expected = [line.strip() for line in f if line.strip()]
+    cells = lambda line: [c.strip() for c in line.split("|")]
+    return [cells(l) for l in out_lines] == [cells(l) for l in expected]
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs Hack VM programs without translating them")
+    parser.add_argument("path", help="file.vm, a directory of .vm files, or a VM emulator .tst script")
+    parser.add_argument("--steps", type=int, default=10_000_000,
+                        help="stop after this many VM commands (default: %(default)s)")
+    parser.add_argument("--headless", action="store_true",
+                        help="do not show the screen, only the statistics, --dump values and "
+                             "the text printed through Output")
+    parser.add_argument("--keys", default="", metavar="TEXT",
+                        help="keys typed into Keyboard.readChar/readLine/readInt, \\n for Enter, "
+                             "e.g. --keys '3\\n10\\n'")
+    parser.add_argument("--set", action="append", default=[], metavar="ADDR=VALUE",
+                        help="set RAM[ADDR] before running, e.g. --set 0=256 (repeatable)")
+    parser.add_argument("--dump", action="append", default=[], metavar="ADDR[:COUNT]",
+                        help="print RAM[ADDR] (and the next COUNT-1 words) after running (repeatable)")
+    parser.add_argument("--native", action="append", default=[], metavar="NAME",
+                        help="run this OS function (Math.multiply), class (Math) or 'all' natively "
+                             "even if the program defines it (repeatable)")
+    parser.add_argument("--jack", action="append", default=[], metavar="NAME",
+                        help="never run this function, class or 'all' natively (repeatable); "
+                             "by default only functions the program lacks are native")
+    parser.add_argument("--profile", action="store_true",
+                        help="print calls, exclusive and inclusive VM commands and depth per function")
+    parser.add_argument("--folded", metavar="FILE",
+                        help="write the profile as folded stacks, for flamegraph.pl / speedscope")
+    parser.add_argument("--out-dir", metavar="DIR",
+                        help="with a .tst script: write its .out file into DIR")
+    args = parser.parse_args()
+
+    if args.path.endswith(".tst"):
+        ok = run_test(args.path, args.steps, args.native, args.jack, args.out_dir)
+        print(f"{'PASS' if ok else 'FAIL'} {args.path}")
+        sys.exit(0 if ok else 1)
+
+    try:
+        program = Program(vm_files_in(args.path))
+        keys = [NEW_LINE if c == "\n" else ord(c) for c in args.keys.replace("\\n", "\n")]
+        vm = VM(program, select_natives(program, args.native, args.jack), keys)
+        for setting in args.set:
+            address, value = setting.split("=")
+            vm.ram[int(address)] = int(value)
+        vm.boot()
+        profiler = vm.profile() if args.profile or args.folded else None
+        start = time.perf_counter()
+        vm.run(args.steps)
+    except VMError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    status = "halted" if vm.halted else "step budget used up"
+    rate = vm.steps / elapsed if elapsed else 0.0
+    print(f"{vm.steps} VM commands in {elapsed:.3f}s ({rate:,.0f} ops/s), {status}")
+    if vm.native_calls:
+        calls = sorted(((n, program.names[f]) for f, n in vm.native_calls.items()), reverse=True)
+        print("Native calls: " + ", ".join(f"{name} {n}" for n, name in calls))
+    if profiler:
+        profiler.finish(vm.steps)
+        if args.profile:
+            print(profiler.report())
+        if args.folded:
+            with open(args.folded, 'w') as f:
+                f.write("\n".join(profiler.folded()) + "\n")
+    for spec in args.dump:
+        address, _, count = spec.partition(":")
+        address = int(address)
+        values = vm.ram[address:address + int(count or 1)]
+        print(f"RAM[{address}]: " + " ".join(str(v) for v in values))
+    text = vm.os.output_text()
+    if text:
+        print(text)
+    if not args.headless:
+        screen = vm.screen_text()
+        if screen:
+            print(screen)
+
+if __name__ == "__main__":
+    main()